@@ -0,0 +1,192 @@
+import os
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Set
+
+from fastapi import HTTPException, Request
+
+from genmeme.metrics import REGISTRY
+
+DEFAULT_RATE_LIMIT_PER_MINUTE = 0.0
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_RATE_LIMIT_BY = "ip"
+DEFAULT_TRUSTED_PROXIES = 0
+DEFAULT_MAX_QUEUE_DEPTH = 0
+DEFAULT_MAX_TRACKED_CLIENTS = 10000
+DEFAULT_SERVICE_RATE_WINDOW = 100
+DEFAULT_RETRY_AFTER = 60
+MAX_RETRY_AFTER = 3600
+
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "genmeme_admission_rejections_total",
+    "Submissions rejected with 429 by reason: rate_limit or queue_full",
+    ["reason"],
+)
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    Address of the client, seen through TRUSTED_PROXIES reverse proxies.
+
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client is the entry added by the outermost one.
+    Entries further left are sent by the client and are not trusted.
+    """
+    trusted_proxies = int(os.getenv("TRUSTED_PROXIES", DEFAULT_TRUSTED_PROXIES))
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if trusted_proxies > 0 and forwarded_for:
+        addresses = [a.strip() for a in forwarded_for.split(",") if a.strip()]
+        if addresses:
+            return addresses[-min(trusted_proxies, len(addresses))]
+    if request.client:
+        return request.client.host
+    return "unknown"
+
+
+def get_allowed_api_keys() -> Set[str]:
+    api_keys = os.getenv("RATE_LIMIT_API_KEYS", "")
+    return {key.strip() for key in api_keys.split(",") if key.strip()}
+
+
+def get_client_id(request: Request) -> str:
+    """
+    Identity used for rate limiting and fair scheduling.
+
+    With RATE_LIMIT_BY=key, an X-API-Key listed in RATE_LIMIT_API_KEYS,
+    otherwise the client IP, so made-up keys do not get fresh buckets.
+    """
+    rate_limit_by = os.getenv("RATE_LIMIT_BY", DEFAULT_RATE_LIMIT_BY).lower()
+    api_key = request.headers.get("X-API-Key")
+    if rate_limit_by == "key" and api_key and api_key in get_allowed_api_keys():
+        return f"key:{api_key}"
+    return f"ip:{get_client_ip(request)}"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Take cost tokens, returns 0 on success or seconds until they are available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if cost <= self.tokens:
+            self.tokens -= cost
+            return 0.0
+        if cost > self.burst:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token bucket per client, refilled at rate tokens per second up to burst.
+
+    Only the max_clients most recently seen clients are tracked; a forgotten
+    client starts again with a full bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE_LIMIT_PER_MINUTE / 60,
+        burst: float = DEFAULT_RATE_LIMIT_BURST,
+        max_clients: int = DEFAULT_MAX_TRACKED_CLIENTS,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, client_id: str, cost: float = 1.0) -> float:
+        """Returns 0 if the client may submit cost jobs, else seconds to wait."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self.buckets[client_id] = bucket
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client_id)
+            bucket.rate = self.rate
+            bucket.burst = self.burst
+        return bucket.take(cost, now)
+
+
+class ServiceRateMeter:
+    """Jobs finished per second, measured over the last window_size jobs."""
+
+    def __init__(self, window_size: int = DEFAULT_SERVICE_RATE_WINDOW) -> None:
+        self.finished_at: Deque[float] = deque(maxlen=window_size)
+
+    def record(self) -> None:
+        self.finished_at.append(time.monotonic())
+
+    def get_rate(self) -> Optional[float]:
+        if len(self.finished_at) < 2:
+            return None
+        elapsed = self.finished_at[-1] - self.finished_at[0]
+        if elapsed <= 0:
+            return None
+        return (len(self.finished_at) - 1) / elapsed
+
+
+RATE_LIMITER = RateLimiter()
+SERVICE_RATE = ServiceRateMeter()
+
+
+def configure_admission_from_env() -> None:
+    RATE_LIMITER.rate = (
+        float(os.getenv("RATE_LIMIT_PER_MINUTE", DEFAULT_RATE_LIMIT_PER_MINUTE)) / 60
+    )
+    RATE_LIMITER.burst = float(os.getenv("RATE_LIMIT_BURST", DEFAULT_RATE_LIMIT_BURST))
+
+
+def format_retry_after(seconds: float) -> str:
+    return str(max(1, min(MAX_RETRY_AFTER, math.ceil(seconds))))
+
+
+def get_queue_retry_after(excess_jobs: int) -> float:
+    # Time for the workers to bring the queue back under the ceiling
+    rate = SERVICE_RATE.get_rate()
+    if rate is None:
+        return DEFAULT_RETRY_AFTER
+    return excess_jobs / rate
+
+
+def check_admission(client_id: str, queue_size: int, cost: int = 1) -> None:
+    """
+    Raise 429 if cost more jobs would exceed MAX_QUEUE_DEPTH or the client's rate limit.
+
+    The queue depth is checked first, so a rejected submission does not
+    use up the client's tokens.
+    """
+    max_queue_depth = int(os.getenv("MAX_QUEUE_DEPTH", DEFAULT_MAX_QUEUE_DEPTH))
+    if max_queue_depth > 0 and queue_size + cost > max_queue_depth:
+        ADMISSION_REJECTIONS.inc(reason="queue_full")
+        retry_after = get_queue_retry_after(queue_size + cost - max_queue_depth)
+        raise HTTPException(
+            status_code=429,
+            detail="The queue is full, try again later",
+            headers={"Retry-After": format_retry_after(retry_after)},
+        )
+
+    wait_time = RATE_LIMITER.take(client_id, cost)
+    if wait_time > 0:
+        ADMISSION_REJECTIONS.inc(reason="rate_limit")
+        detail = "Too many requests, try again later"
+        headers = {"Retry-After": format_retry_after(wait_time)}
+        if math.isinf(wait_time):
+            detail = f"At most {RATE_LIMITER.burst:g} jobs can be submitted at once"
+            headers = {}
+        raise HTTPException(status_code=429, detail=detail, headers=headers)
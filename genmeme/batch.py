@@ -0,0 +1,169 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, Iterator, Set, TextIO
+
+import fire  # type: ignore
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+from genmeme.files import PROMPT_PATH, TEMPLATES_PATH
+from genmeme.gen import (
+    generate_meme,
+    DEFAULT_MODEL_NAME,
+    DEFAULT_IMAGE_TEMPLATES_COUNT,
+)
+from genmeme.llm import configure_retries_from_env, close_client_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_CONCURRENCY = 4
+
+
+def get_item_id(item: Dict[str, Any], line_number: int) -> str:
+    return str(item.get("id", line_number))
+
+
+def read_finished_ids(output_path: str) -> Set[str]:
+    """Ids of items that already have a completed result in the output file."""
+    finished_ids: Set[str] = set()
+    if not os.path.exists(output_path):
+        return finished_ids
+    with open(output_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line of an interrupted run
+                continue
+            if result.get("status") == "completed":
+                finished_ids.add(str(result["id"]))
+    return finished_ids
+
+
+def read_items(input_path: str, finished_ids: Set[str]) -> Iterator[Dict[str, Any]]:
+    with open(input_path) as f:
+        for line_number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item["id"] = get_item_id(item, line_number)
+            if item["id"] not in finished_ids:
+                yield item
+
+
+async def process_item(
+    item: Dict[str, Any],
+    generate_prompt_path: str,
+    templates_path: str,
+    model_name: str,
+    image_templates_count: int,
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"id": item["id"], "prompt": item["prompt"]}
+    try:
+        response = await generate_meme(
+            item["prompt"],
+            generate_prompt_path=generate_prompt_path,
+            templates_path=templates_path,
+            selected_template_id=item.get("selected_template_id"),
+            model_name=model_name,
+            image_templates_count=image_templates_count,
+        )
+        result.update(
+            status="completed",
+            file_name=response.file_name,
+            template_ids=response.template_ids,
+        )
+    except Exception as e:
+        logger.error(f"Item {item['id']} failed: {e}")
+        result.update(status="failed", error=str(e))
+    return result
+
+
+def ensure_trailing_newline(output_path: str) -> None:
+    # An interrupted run may leave a partial line without a newline
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def write_result(output_file: TextIO, result: Dict[str, Any]) -> None:
+    output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+    output_file.flush()
+
+
+async def generate_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    generate_prompt_path: str = str(PROMPT_PATH),
+    templates_path: str = str(TEMPLATES_PATH),
+    model_name: str = DEFAULT_MODEL_NAME,
+    image_templates_count: int = DEFAULT_IMAGE_TEMPLATES_COUNT,
+) -> None:
+    """
+    Generate memes for every prompt of a JSONL file.
+
+    Each input line is {"prompt": ..., "id": ..., "selected_template_id": ...},
+    "id" defaults to the line number. Results are appended to output_path
+    as soon as they are ready, so an interrupted run resumes by skipping
+    items that already have a completed result there; failed items are retried.
+
+    Args:
+        input_path: JSONL file with prompts
+        output_path: JSONL file with results, also used as the checkpoint
+        concurrency: Maximum number of simultaneous generations
+        generate_prompt_path: Prompt template path
+        templates_path: templates.json path
+        model_name: OpenRouter model
+        image_templates_count: Number of random templates per meme
+    """
+    configure_retries_from_env()
+    finished_ids = read_finished_ids(output_path)
+    ensure_trailing_newline(output_path)
+    items = read_items(input_path, finished_ids)
+    with open(input_path) as f:
+        total = sum(1 for line in f if line.strip())
+    failed_count = 0
+
+    with (
+        open(output_path, "a") as output_file,
+        tqdm(total=total, initial=len(finished_ids)) as progress,
+    ):
+
+        async def run_worker() -> None:
+            nonlocal failed_count
+            # Workers share one iterator, so at most `concurrency` items are in flight
+            for item in items:
+                result = await process_item(
+                    item,
+                    generate_prompt_path=generate_prompt_path,
+                    templates_path=templates_path,
+                    model_name=model_name,
+                    image_templates_count=image_templates_count,
+                )
+                if result["status"] != "completed":
+                    failed_count += 1
+                write_result(output_file, result)
+                progress.update(1)
+
+        try:
+            await asyncio.gather(*[run_worker() for _ in range(max(1, concurrency))])
+        finally:
+            await close_client_pool()
+
+    logger.info(f"Batch finished, {failed_count} failed items")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    fire.Fire(generate_batch)
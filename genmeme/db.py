@@ -1,8 +1,34 @@
-from typing import Optional
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
 from datetime import datetime
 
-from sqlalchemy import create_engine, String, DateTime
-from sqlalchemy.orm import DeclarativeBase, sessionmaker, Mapped, mapped_column
+from sqlalchemy import (
+    create_engine,
+    event,
+    func,
+    inspect,
+    text,
+    select,
+    String,
+    DateTime,
+    Float,
+    Engine,
+    Index,
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Session,
+    sessionmaker,
+    Mapped,
+    mapped_column,
+)
+
+T = TypeVar("T")
 
 
 class Base(DeclarativeBase):
@@ -20,9 +46,273 @@ class ImageRecord(Base):
     )
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     template_ids: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    thumbnail_variants: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    job_id: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_images_created_at_result_id", "created_at", "result_id"),
+    )
+
+
+class JobRecord(Base):
+    __tablename__ = "jobs"
+    job_id: Mapped[str] = mapped_column(String, primary_key=True)
+    prompt: Mapped[str]
+    selected_template_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    status: Mapped[str] = mapped_column(String, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    result_url: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    result_template_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime, nullable=True
+    )
+    dedup_key: Mapped[Optional[str]] = mapped_column(String, nullable=True, index=True)
+    client_id: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    priority: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    fair_tag: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_fair_tag", "status", "fair_tag", "created_at"),
+        Index("ix_jobs_started_at", "started_at"),
+    )
+
+
+def ignore_concurrent_change(change: Callable[[], None]) -> None:
+    # Another process may make the same change between our check and ours
+    try:
+        change()
+    except OperationalError as e:
+        message = str(e.orig)
+        if "already exists" not in message and "duplicate column name" not in message:
+            raise
+
+
+def add_missing_columns(engine: Engine) -> None:
+    # create_all does not alter existing tables, new nullable columns are added here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(engine.dialect)
+            statement = text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            )
+
+            def add_column(statement: Any = statement) -> None:
+                with engine.begin() as connection:
+                    connection.execute(statement)
+
+            ignore_concurrent_change(add_column)
+
+
+def add_missing_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            ignore_concurrent_change(partial(index.create, engine, checkfirst=True))
+
+
+def create_schema(engine: Engine) -> None:
+    """
+    Create missing tables, columns and indexes.
+
+    Server and worker processes started together all run this against the
+    same file, so changes another process made first are ignored.
+    """
+    for table in Base.metadata.sorted_tables:
+        ignore_concurrent_change(partial(table.create, engine, checkfirst=True))
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+
+
+SQLITE_PRAGMAS = (
+    # Set first, switching to WAL waits for other connections' locks
+    ("busy_timeout", "5000"),
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-16000"),
+    ("temp_store", "MEMORY"),
+)
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+class ImageStore:
+    """
+    Runs database work off the event loop.
+
+    Inserts go to a dedicated writer thread that commits everything queued
+    since its previous commit in one transaction. Reads run in a small
+    thread pool, which WAL mode allows to proceed alongside the writer.
+
+    The number of images is counted once by the writer thread and then
+    maintained on insert. Rows inserted by other processes are picked up
+    by sync_count(), which servers sharing the database call periodically.
+    `generation` is bumped after every committed insert, so readers can
+    tell whether data they cached is still current.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_batch_size: int = 64,
+        read_threads: int = 2,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.read_threads = read_threads
+        self.commits_count = 0
+        self.inserts_count = 0
+        self.generation = 0
+        self._queue: queue.SimpleQueue[
+            Optional[Tuple[ImageRecord, "asyncio.Future[None]"]]
+        ] = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._count = 0
+        self._count_ready = threading.Event()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="image-store-writer", daemon=True
+                )
+                self._writer.start()
+            if self._readers is None:
+                self._readers = ThreadPoolExecutor(
+                    max_workers=self.read_threads,
+                    thread_name_prefix="image-store-reader",
+                )
+
+    def stop(self) -> None:
+        with self._lock:
+            writer, self._writer = self._writer, None
+            readers, self._readers = self._readers, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        if readers is not None:
+            readers.shutdown(wait=True)
+
+    async def add(self, record: ImageRecord) -> None:
+        """Insert a record, returns once the transaction with it is committed."""
+        self.start()
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._queue.put((record, future))
+        await future
+
+    async def run(self, fn: Callable[[Session], T]) -> T:
+        """Run fn with a fresh session in the reader pool."""
+        self.start()
+        assert self._readers is not None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn)
+
+    def get_count(self) -> int:
+        """Number of images, blocks until the initial count is known."""
+        self.start()
+        self._count_ready.wait()
+        return self._count
+
+    async def sync_count(self) -> None:
+        """Recount images, bumping `generation` if another process inserted some."""
+        await self.run(self._sync_count)
+
+    def _sync_count(self, session: Session) -> None:
+        with self._count_lock:
+            count = session.scalar(select(func.count()).select_from(ImageRecord)) or 0
+            if count != self._count:
+                self._count = count
+                self.generation += 1
+
+    def _run_read(self, fn: Callable[[Session], T]) -> T:
+        with self.session_factory() as session:
+            return fn(session)
+
+    def _write_loop(self) -> None:
+        if not self._count_ready.is_set():
+            with self.session_factory() as session:
+                count = session.scalar(select(func.count()).select_from(ImageRecord))
+            self._count = count or 0
+            self._count_ready.set()
+
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[ImageRecord, "asyncio.Future[None]"]]) -> None:
+        try:
+            self._insert([record for record, _ in batch])
+            results: List[Optional[BaseException]] = [None] * len(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                results = [e]
+            else:
+                # Retry one by one so a single bad record does not fail the others
+                results = []
+                for record, _ in batch:
+                    try:
+                        self._insert([record])
+                        results.append(None)
+                    except Exception as record_error:
+                        results.append(record_error)
+        for (_, future), error in zip(batch, results):
+            future.get_loop().call_soon_threadsafe(_resolve_future, future, error)
+
+    def _insert(self, records: List[ImageRecord]) -> None:
+        # The lock keeps sync_count() from counting these rows a second time
+        with self._count_lock:
+            with self.session_factory() as session:
+                session.add_all(records)
+                session.commit()
+            self._count += len(records)
+            self.generation += 1
+        self.commits_count += 1
+        self.inserts_count += len(records)
+
+
+def _resolve_future(
+    future: "asyncio.Future[None]", error: Optional[BaseException]
+) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
 
 
 SQL_DATABASE_URL = "sqlite:///./images.db"
 SQL_ENGINE = create_engine(SQL_DATABASE_URL)
+event.listen(SQL_ENGINE, "connect", set_sqlite_pragmas)
 SessionLocal = sessionmaker(bind=SQL_ENGINE)
-Base.metadata.create_all(SQL_ENGINE)
+create_schema(SQL_ENGINE)
+IMAGE_STORE = ImageStore(SessionLocal)
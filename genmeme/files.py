@@ -6,4 +6,5 @@ TEMPLATES_PATH = ROOT_PATH / "templates.json"
 PROMPTS_DIR_PATH = DIR_PATH / "prompts"
 STORAGE_PATH = ROOT_PATH / "output"
 PROMPT_PATH = PROMPTS_DIR_PATH / "gen.jinja"
+TEMPLATE_PROMPT_PATH = PROMPTS_DIR_PATH / "gen_template.jinja"
 IMAGES_PATH = ROOT_PATH / "images"
@@ -1,21 +1,22 @@
 import os
 import random
-import json
 import time
 from dataclasses import dataclass, field
-from pathlib import Path
-from typing import List
+from typing import List, Dict, Tuple
 
 import fire  # type: ignore
 from typing import Optional
 from jinja2 import Template
 from dotenv import load_dotenv
+from openai import AsyncOpenAI
 
-from genmeme.files import TEMPLATES_PATH, PROMPT_PATH, IMAGES_PATH
+from genmeme.files import TEMPLATES_PATH, PROMPT_PATH, IMAGES_PATH, TEMPLATE_PROMPT_PATH
+from genmeme.templates import MemeTemplate, TemplateRegistry, get_template_registry
 from genmeme.llm import (
     openrouter_nano_banana_generate,
     OPENROUTER_DEFAULT_MODEL,
 )
+from genmeme.metrics import STAGE_DURATION
 
 
 MEMEGEN_HOST = "http://localhost:5051"
@@ -24,6 +25,63 @@ DEFAULT_IMAGE_TEMPLATES_COUNT = 1
 MAX_QUERY_LENGTH = 600
 
 
+def get_template_image_path(template_id: str) -> str:
+    images_path = os.getenv("IMAGES_PATH") or str(IMAGES_PATH)
+    return os.path.join(images_path, f"{template_id}.jpg")
+
+
+class PromptCache:
+    """
+    Compiled prompt templates and pre-rendered per-template prompt blocks.
+
+    Compiled templates are invalidated by the prompt file's mtime,
+    rendered blocks by the block template's mtime or a templates.json reload.
+    """
+
+    def __init__(self) -> None:
+        self._templates: Dict[str, Tuple[int, Template]] = {}
+        self._fragments: Dict[str, Tuple[Tuple[object, ...], Dict[str, str]]] = {}
+
+    def get_template(self, path: str, keep_trailing_newline: bool = False) -> Template:
+        mtime_ns = os.stat(path).st_mtime_ns
+        entry = self._templates.get(path)
+        if entry is None or entry[0] != mtime_ns:
+            with open(path) as f:
+                template = Template(
+                    f.read(), keep_trailing_newline=keep_trailing_newline
+                )
+            entry = (mtime_ns, template)
+            self._templates[path] = entry
+        return entry[1]
+
+    def render_fragments(
+        self,
+        registry: TemplateRegistry,
+        meme_templates: List[MemeTemplate],
+        fragment_path: str = str(TEMPLATE_PROMPT_PATH),
+    ) -> List[str]:
+        fragment_template = self.get_template(fragment_path, keep_trailing_newline=True)
+        version = (fragment_path, self._templates[fragment_path][0], registry.version)
+        registry_key = str(registry.path)
+        entry = self._fragments.get(registry_key)
+        if entry is None or entry[0] != version:
+            entry = (version, {})
+            self._fragments[registry_key] = entry
+
+        rendered = entry[1]
+        fragments = []
+        for template in meme_templates:
+            fragment = rendered.get(template["id"])
+            if fragment is None:
+                fragment = fragment_template.render(template=template)
+                rendered[template["id"]] = fragment
+            fragments.append(fragment)
+        return fragments
+
+
+PROMPT_CACHE = PromptCache()
+
+
 @dataclass
 class MemeResponse:
     file_name: str
@@ -37,53 +95,57 @@ async def generate_meme(
     selected_template_id: Optional[str] = None,
     model_name: str = DEFAULT_MODEL_NAME,
     image_templates_count: int = DEFAULT_IMAGE_TEMPLATES_COUNT,
+    client: Optional[AsyncOpenAI] = None,
 ) -> MemeResponse:
     random.seed(time.time())
 
     # Select templates
-    all_templates = json.loads(Path(templates_path).read_text())
-
-    if selected_template_id:
-        meme_templates = [t for t in all_templates if t["id"] == selected_template_id]
-    else:
-        image_templates = [
-            t for t in all_templates if t.get("type", "image") == "image"
-        ]
-        assert image_templates
-        meme_templates = random.sample(image_templates, image_templates_count)
-        random.shuffle(meme_templates)
+    with STAGE_DURATION.time(stage="template_selection"):
+        registry = get_template_registry(templates_path)
+
+        if selected_template_id:
+            selected_template = registry.get(selected_template_id)
+            meme_templates = [selected_template] if selected_template else []
+        else:
+            assert registry.image_templates
+            meme_templates = random.sample(
+                registry.image_templates, image_templates_count
+            )
+            random.shuffle(meme_templates)
 
     meme_images = []
     template_ids = []
     for template in meme_templates:
         meme_id = template["id"]
-        file_path = os.path.join(IMAGES_PATH, f"{meme_id}.jpg")
-        meme_images.append(file_path)
+        meme_images.append(get_template_image_path(meme_id))
         template_ids.append(meme_id)
 
     # Generate prompt
-    with open(generate_prompt_path) as f:
-        prompt_template = Template(f.read())
-
-    cut_query = query
-    if len(query) >= MAX_QUERY_LENGTH:
-        space_pos = query.find(" ", MAX_QUERY_LENGTH)
-        if space_pos != -1:
-            cut_query = query[:space_pos] + "..."
-
-    prompt = (
-        prompt_template.render(
-            query=cut_query,
-            meme_templates=meme_templates,
-        ).strip()
-        + "\n"
-    )
+    with STAGE_DURATION.time(stage="prompt_render"):
+        prompt_template = PROMPT_CACHE.get_template(generate_prompt_path)
+        template_fragments = PROMPT_CACHE.render_fragments(registry, meme_templates)
+
+        cut_query = query
+        if len(query) >= MAX_QUERY_LENGTH:
+            space_pos = query.find(" ", MAX_QUERY_LENGTH)
+            if space_pos != -1:
+                cut_query = query[:space_pos] + "..."
+
+        prompt = (
+            prompt_template.render(
+                query=cut_query,
+                meme_templates=meme_templates,
+                template_fragments=template_fragments,
+            ).strip()
+            + "\n"
+        )
 
     # Generate meme
     output_image_path = await openrouter_nano_banana_generate(
         prompt=prompt,
         input_images=meme_images,
         model_name=model_name,
+        client=client,
     )
 
     return MemeResponse(
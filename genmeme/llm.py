@@ -1,16 +1,501 @@
 import os
 import uuid
-from typing import Optional, Any, List, cast
+import time
+import tempfile
+import random
+import asyncio
+import logging
+import datetime
+import email.utils
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Optional,
+    Any,
+    List,
+    Dict,
+    Iterable,
+    Tuple,
+    Callable,
+    Awaitable,
+    TypeVar,
+    cast,
+)
 import base64
 from pathlib import Path
 
-from openai import AsyncOpenAI
+import httpx
+import openai
+from PIL import Image
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
 from genmeme.files import STORAGE_PATH
+from genmeme.metrics import STAGE_DURATION, UPSTREAM_ERRORS, UPSTREAM_RETRIES
 
 
+T = TypeVar("T")
+
+logger = logging.getLogger("uvicorn")
+
 OPENROUTER_DEFAULT_MODEL = "google/gemini-3-pro-image-preview"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 16
+DEFAULT_KEEPALIVE_EXPIRY = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_REQUEST_TIMEOUT = 300.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_DELAY = 1.0
+DEFAULT_RETRY_MAX_DELAY = 60.0
+DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 30.0
+TRIAL_POLL_INTERVAL = 0.5
+
+
+DECODE_CHUNK_SIZE = 1024 * 1024
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+class NoImageGeneratedError(ValueError):
+    pass
+
+
+def detect_image_extension(header: bytes) -> Optional[str]:
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def get_data_url_image_extension(image_url: str) -> str:
+    """Sniff the image format from the first bytes of a base64 data URL."""
+    comma_pos = image_url.find(",")
+    if not image_url.startswith("data:") or comma_pos == -1:
+        raise NoImageGeneratedError("Generated image is not a data URL")
+    try:
+        header = base64.b64decode(image_url[comma_pos + 1 : comma_pos + 1 + 64])
+    except ValueError:
+        raise NoImageGeneratedError("Generated image is not valid base64")
+    extension = detect_image_extension(header)
+    if extension is None:
+        raise NoImageGeneratedError("Generated data is not a known image format")
+    return extension
+
+
+def verify_image(path: str) -> None:
+    """Decode the whole image; Image.verify() misses truncated JPEG and GIF data."""
+    try:
+        with Image.open(path) as img:
+            img.load()
+    except Exception as e:
+        raise NoImageGeneratedError(f"Generated image is corrupt: {e}") from e
+
+
+def save_data_url(image_url: str, storage_path: Path) -> Path:
+    """
+    Decode a base64 data URL into storage_path and return the file path.
+
+    Decoding is done chunk by chunk into a temporary file that is renamed
+    to <uuid>.<real extension> once complete and decodable, so the output
+    directory never exposes partially written or corrupt images.
+    """
+    extension = get_data_url_image_extension(image_url)
+    start = image_url.find(",") + 1
+    fd, temp_path = tempfile.mkstemp(dir=storage_path, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # Chunk size is a multiple of 4, so chunks decode independently
+            for chunk_start in range(start, len(image_url), DECODE_CHUNK_SIZE):
+                chunk = image_url[chunk_start : chunk_start + DECODE_CHUNK_SIZE]
+                if len(chunk) % 4:
+                    chunk += "=" * (-len(chunk) % 4)
+                f.write(base64.b64decode(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        verify_image(temp_path)
+        file_path = storage_path / f"{uuid.uuid4()}.{extension}"
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return file_path
+
+
+NON_RETRYABLE_ERRORS = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.BadRequestError,
+    openai.NotFoundError,
+    openai.UnprocessableEntityError,
+)
+
+RETRYABLE_ERRORS = (
+    NoImageGeneratedError,
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    if isinstance(error, NON_RETRYABLE_ERRORS):
+        return False
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether the error shows upstream is unhealthy, not that it refused one request."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return False
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from the Retry-After (or retry-after-ms) header of an API error."""
+    if not isinstance(error, openai.APIStatusError):
+        return None
+    headers = error.response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    base_delay: float = DEFAULT_RETRY_BASE_DELAY
+    max_delay: float = DEFAULT_RETRY_MAX_DELAY
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Exponential backoff with full jitter, a server-provided delay wins."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops upstream calls after consecutive upstream failures.
+
+    Only rate limits, server errors, timeouts and connection errors count,
+    see is_upstream_failure; a response without an image does not.
+
+    Opens after failure_threshold failures in a row. After reset_timeout
+    seconds one trial call is let through (half-open): its success closes
+    the circuit, its failure opens it again. Other calls wait until the
+    trial is over instead of failing.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures_count = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def get_open_time_left(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial_in_progress or self.get_open_time_left() > 0:
+            return False
+        self.trial_in_progress = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures_count = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self.failures_count += 1
+        if self.trial_in_progress or self.failures_count >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("Upstream circuit breaker opened")
+            self.opened_at = time.monotonic()
+        self.trial_in_progress = False
+
+    async def wait_until_closed(self) -> None:
+        """Wait until the circuit is closed or a trial call may be made."""
+        while self.trial_in_progress or self.get_open_time_left() > 0:
+            if self.trial_in_progress:
+                await asyncio.sleep(TRIAL_POLL_INTERVAL)
+            else:
+                await asyncio.sleep(self.get_open_time_left())
+
+
+RETRY_POLICY = RetryPolicy()
+CIRCUIT_BREAKER = CircuitBreaker()
+
+
+def configure_retries_from_env() -> None:
+    RETRY_POLICY.max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+    RETRY_POLICY.base_delay = float(
+        os.getenv("LLM_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY)
+    )
+    RETRY_POLICY.max_delay = float(
+        os.getenv("LLM_RETRY_MAX_DELAY", DEFAULT_RETRY_MAX_DELAY)
+    )
+    CIRCUIT_BREAKER.failure_threshold = int(
+        os.getenv("CIRCUIT_FAILURE_THRESHOLD", DEFAULT_CIRCUIT_FAILURE_THRESHOLD)
+    )
+    CIRCUIT_BREAKER.reset_timeout = float(
+        os.getenv("CIRCUIT_RESET_SECONDS", DEFAULT_CIRCUIT_RESET_TIMEOUT)
+    )
+
+
+async def call_with_retries(
+    call: Callable[[], Awaitable[T]],
+    policy: RetryPolicy = RETRY_POLICY,
+    breaker: CircuitBreaker = CIRCUIT_BREAKER,
+) -> T:
+    max_attempts = max(1, policy.max_attempts)
+    attempt = 0
+    while True:
+        if not breaker.allow_request():
+            # Attempts are only used by calls that reach upstream
+            await breaker.wait_until_closed()
+            continue
+
+        is_last_attempt = attempt == max_attempts - 1
+        # Only the trial call may clear trial_in_progress
+        is_trial = breaker.is_open
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # A cancelled trial says nothing about upstream, the next call tries again
+            if is_trial:
+                breaker.trial_in_progress = False
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(error=type(e).__name__)
+            if not is_retryable_error(e):
+                if is_trial:
+                    breaker.trial_in_progress = False
+                raise
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            else:
+                # Upstream answered, e.g. without an image, so it is healthy
+                breaker.record_success()
+            if is_last_attempt:
+                raise
+            UPSTREAM_RETRIES.inc()
+            delay = policy.get_delay(attempt, get_retry_after(e))
+            logger.warning(
+                f"Upstream call failed (attempt {attempt + 1}/{max_attempts}), retrying in {delay:.1f}s: {e}"
+            )
+            attempt += 1
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+class ImagePartCache:
+    """
+    LRU cache of ready-to-send base64 "image_url" content parts.
+
+    Entries are keyed by path and invalidated when the file's mtime changes.
+    The total size of cached data URLs is kept under max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_IMAGE_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[int, Dict[str, Any], int]] = OrderedDict()
+
+    def get(self, image_path: str) -> Dict[str, Any]:
+        mtime_ns = os.stat(image_path).st_mtime_ns
+        entry = self._entries.get(image_path)
+        if entry is not None and entry[0] == mtime_ns:
+            self._entries.move_to_end(image_path)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        base64_data = base64.b64encode(image_bytes).decode("utf-8")
+        image_url = f"data:image/jpeg;base64,{base64_data}"
+        part = {"type": "image_url", "image_url": {"url": image_url}}
+        self._put(image_path, mtime_ns, part, len(image_url))
+        return part
+
+    def warm_up(self, image_paths: Iterable[str]) -> None:
+        for image_path in image_paths:
+            if os.path.exists(image_path):
+                self.get(image_path)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def _put(
+        self, image_path: str, mtime_ns: int, part: Dict[str, Any], size: int
+    ) -> None:
+        old_entry = self._entries.pop(image_path, None)
+        if old_entry is not None:
+            self.current_bytes -= old_entry[2]
+        if size > self.max_bytes:
+            return
+        self._entries[image_path] = (mtime_ns, part, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+
+IMAGE_CACHE = ImagePartCache()
+
+
+class OpenRouterClientPool:
+    """
+    AsyncOpenAI clients for one or more API keys over a single keep-alive HTTP pool.
+
+    get() rotates through the configured keys round-robin.
+    """
+
+    def __init__(
+        self,
+        api_keys: List[str],
+        base_url: str = OPENROUTER_BASE_URL,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ) -> None:
+        self.base_url = base_url
+        self.api_keys = api_keys
+        self.http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(request_timeout, connect=connect_timeout),
+        )
+        self._clients: Dict[str, AsyncOpenAI] = {}
+        self._next_key_index = 0
+
+    def get(self, api_key: Optional[str] = None) -> AsyncOpenAI:
+        if not api_key:
+            assert self.api_keys, "No OpenRouter API keys configured"
+            api_key = self.api_keys[self._next_key_index % len(self.api_keys)]
+            self._next_key_index += 1
+        client = self._clients.get(api_key)
+        if client is None:
+            # Retries are done by call_with_retries
+            client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=api_key,
+                http_client=self.http_client,
+                max_retries=0,
+            )
+            self._clients[api_key] = client
+        return client
+
+    async def aclose(self) -> None:
+        self._clients.clear()
+        await self.http_client.aclose()
+
+
+def get_api_keys_from_env() -> List[str]:
+    keys = os.environ.get("OPENROUTER_API_KEYS", "")
+    api_keys = [key.strip() for key in keys.split(",") if key.strip()]
+    if not api_keys and os.environ.get("OPENROUTER_API_KEY"):
+        api_keys = [os.environ["OPENROUTER_API_KEY"]]
+    return api_keys
+
+
+def create_client_pool_from_env() -> OpenRouterClientPool:
+    return OpenRouterClientPool(
+        api_keys=get_api_keys_from_env(),
+        base_url=os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL),
+        max_connections=int(
+            os.getenv("OPENROUTER_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+        ),
+        max_keepalive_connections=int(
+            os.getenv(
+                "OPENROUTER_MAX_KEEPALIVE_CONNECTIONS",
+                DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+            )
+        ),
+        keepalive_expiry=float(
+            os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+        ),
+        connect_timeout=float(
+            os.getenv("OPENROUTER_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        ),
+        request_timeout=float(
+            os.getenv("OPENROUTER_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
+        ),
+    )
+
+
+_CLIENT_POOL: Optional[OpenRouterClientPool] = None
+
+
+def get_client_pool() -> OpenRouterClientPool:
+    global _CLIENT_POOL
+    if _CLIENT_POOL is None:
+        _CLIENT_POOL = create_client_pool_from_env()
+    return _CLIENT_POOL
+
+
+async def close_client_pool() -> None:
+    global _CLIENT_POOL
+    if _CLIENT_POOL is not None:
+        await _CLIENT_POOL.aclose()
+        _CLIENT_POOL = None
 
 
 async def openrouter_nano_banana_generate(
@@ -18,23 +503,17 @@ async def openrouter_nano_banana_generate(
     input_images: List[str],
     model_name: str = OPENROUTER_DEFAULT_MODEL,
     api_key: Optional[str] = None,
+    client: Optional[AsyncOpenAI] = None,
     **kwargs: Any,
 ) -> Path:
-    if not api_key:
-        api_key = os.environ.get("OPENROUTER_API_KEY", None)
-    client = AsyncOpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
+    if client is None:
+        client = get_client_pool().get(api_key)
 
     content_parts = []
-    for input_image_path in input_images:
-        assert os.path.exists(input_image_path)
-        with open(input_image_path, "rb") as f:
-            image_bytes = f.read()
-        base64_data = base64.b64encode(image_bytes).decode("utf-8")
-        image_url = f"data:image/jpeg;base64,{base64_data}"
-        content_parts.append({"type": "image_url", "image_url": {"url": image_url}})
+    with STAGE_DURATION.time(stage="image_encoding"):
+        for input_image_path in input_images:
+            assert os.path.exists(input_image_path)
+            content_parts.append(IMAGE_CACHE.get(input_image_path))
     content_parts.append({"type": "text", "text": prompt})
     messages = [
         {
@@ -46,28 +525,31 @@ async def openrouter_nano_banana_generate(
         cast(ChatCompletionMessageParam, message) for message in messages
     ]
 
-    response = await client.chat.completions.create(
-        model=model_name,
-        messages=casted_messages,
-        extra_body={
-            "modalities": ["image"],
-            "image_config": {
-                "image_size": "1K",
-            },
-        },
-        **kwargs,
-    )
+    async def request_image() -> str:
+        assert client is not None
+        with STAGE_DURATION.time(stage="upstream_call"):
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=casted_messages,
+                extra_body={
+                    "modalities": ["image"],
+                    "image_config": {
+                        "image_size": "1K",
+                    },
+                },
+                **kwargs,
+            )
+        if not response.choices:
+            raise NoImageGeneratedError("No image generated, empty response")
 
-    response = response.choices[0].message
-    if not hasattr(response, "images"):
-        raise ValueError("No image generated, response: " + str(response))
-
-    file_name = str(uuid.uuid4()) + ".jpg"
-    file_path = STORAGE_PATH / file_name
-    assert response.images
-    assert len(response.images) == 1
-    image_url = response.images[0]["image_url"]["url"]
-    base64_data = image_url.split(",")[1]
-    with open(file_path, "wb") as f:
-        f.write(base64.b64decode(base64_data))
-    return file_path
+        message = response.choices[0].message
+        images = getattr(message, "images", None)
+        if not images or len(images) != 1:
+            raise NoImageGeneratedError("No image generated, response: " + str(message))
+        image_url: str = images[0]["image_url"]["url"]
+        get_data_url_image_extension(image_url)
+        return image_url
+
+    image_url = await call_with_retries(request_image)
+    with STAGE_DURATION.time(stage="image_write"):
+        return await asyncio.to_thread(save_data_url, image_url, STORAGE_PATH)
@@ -0,0 +1,275 @@
+import math
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_LAG_INTERVAL = 0.5
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(ABC):
+    metric_type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def get_label_values(self, labels: Dict[str, str]) -> LabelValues:
+        assert set(labels) == set(self.label_names), f"Bad labels for {self.name}"
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ] + self.render_samples()
+
+    @abstractmethod
+    def render_samples(self) -> List[str]:
+        pass
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.get_label_values(labels), 0.0)
+
+    def render_samples(self) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Metric):
+    """Gauge set explicitly, for values that cannot be read synchronously."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render_samples(self) -> List[str]:
+        return [f"{self.name} {format_value(self.value)}"]
+
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose value is read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float],
+        metric_type: str = "gauge",
+    ) -> None:
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.metric_type = metric_type
+
+    def render_samples(self) -> List[str]:
+        return [f"{self.name} {format_value(self.callback())}"]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.get_label_values(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self.values[key] = entry
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        entry = self.values.get(self.get_label_values(labels))
+        return sum(entry[0]) if entry else 0
+
+    def render_samples(self) -> List[str]:
+        lines = []
+        bucket_label_names = self.label_names + ("le",)
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = format_labels(bucket_label_names, key + (format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        metric = Gauge(name, documentation)
+        self.register(metric)
+        return metric
+
+    def gauge_callback(
+        self, name: str, documentation: str, callback: Callable[[], float]
+    ) -> None:
+        self.register(CallbackMetric(name, documentation, callback, "gauge"))
+
+    def counter_callback(
+        self, name: str, documentation: str, callback: Callable[[], float]
+    ) -> None:
+        self.register(CallbackMetric(name, documentation, callback, "counter"))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Stages: queue_wait, template_selection, prompt_render, image_encoding,
+# upstream_call, image_write, thumbnails, db_commit
+STAGE_DURATION = REGISTRY.histogram(
+    "genmeme_stage_duration_seconds",
+    "Time spent in each stage of the generation pipeline",
+    ["stage"],
+)
+JOB_DURATION = REGISTRY.histogram(
+    "genmeme_job_duration_seconds",
+    "Time from job creation to completion or failure",
+    ["status"],
+)
+JOBS_FINISHED = REGISTRY.counter(
+    "genmeme_jobs_finished_total", "Jobs finished by the workers", ["status"]
+)
+JOBS_CANCELLED = REGISTRY.counter(
+    "genmeme_jobs_cancelled_total",
+    "Jobs cancelled by clients, by the status they had: queued or processing",
+    ["status"],
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "genmeme_upstream_errors_total",
+    "Failed upstream call attempts by error type",
+    ["error"],
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "genmeme_upstream_retries_total", "Upstream calls retried after a failure"
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "genmeme_event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task",
+    buckets=LAG_BUCKETS,
+)
+
+
+async def monitor_event_loop_lag(interval: float = DEFAULT_LAG_INTERVAL) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start_time = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start_time - interval))
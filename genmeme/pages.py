@@ -0,0 +1,126 @@
+import os
+import gzip
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.staticfiles import PathLike, StaticFiles
+from starlette.types import Scope
+import brotli  # type: ignore
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def get_accepted_encodings(accept_encoding: str) -> List[str]:
+    encodings = []
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.append(name.strip().lower())
+    return encodings
+
+
+def etag_matches(if_none_match: Optional[str], etags: List[str]) -> bool:
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*" or value.removeprefix("W/") in etags:
+            return True
+    return False
+
+
+class StaticPage:
+    """
+    HTML page kept in memory with gzip and brotli versions compressed once.
+
+    The file is re-read only when its mtime or size changes.
+    """
+
+    def __init__(self, path: Path, fallback: str) -> None:
+        self.path = path
+        self.fallback = fallback
+        self.bodies: Dict[str, bytes] = {}
+        self.etags: Dict[str, str] = {}
+        self._stamp: Optional[Tuple[int, int]] = None
+
+    def refresh(self) -> "StaticPage":
+        try:
+            stat = self.path.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = (0, -1)
+        if stamp != self._stamp:
+            if stamp[1] == -1:
+                self._load(self.fallback.encode("utf-8"))
+            else:
+                self._load(self.path.read_bytes())
+            self._stamp = stamp
+        return self
+
+    def _load(self, body: bytes) -> None:
+        bodies = {
+            "identity": body,
+            "gzip": gzip.compress(body, GZIP_LEVEL, mtime=0),
+            "br": brotli.compress(body, quality=BROTLI_QUALITY),
+        }
+        digest = hashlib.sha1(body).hexdigest()
+        # Strong ETags differ between encodings of the same content
+        self.etags = {
+            encoding: (
+                f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            )
+            for encoding in bodies
+        }
+        self.bodies = bodies
+
+    def choose_encoding(self, accept_encoding: str) -> str:
+        accepted = get_accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in accepted:
+                return encoding
+        return "identity"
+
+    def get_response(self, request: Request) -> Response:
+        self.refresh()
+        encoding = self.choose_encoding(request.headers.get("Accept-Encoding", ""))
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        # A cached copy in another encoding is not the representation sent now
+        if etag_matches(request.headers.get("If-None-Match"), [self.etags[encoding]]):
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=self.bodies[encoding],
+            media_type="text/html; charset=utf-8",
+            headers=headers,
+        )
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content that never changes under the same name."""
+
+    def file_response(
+        self,
+        full_path: PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
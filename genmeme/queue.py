@@ -1,19 +1,48 @@
 import asyncio
+import hashlib
+import logging
 import uuid
 import datetime
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Any, Callable, Optional, Dict, List, Set, Tuple, TypeVar
 from enum import Enum
 
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from genmeme.db import JobRecord, SessionLocal
+from genmeme.scheduler import FairScheduler
+
+T = TypeVar("T")
+
+logger = logging.getLogger("uvicorn")
+
 
 class JobStatus(str, Enum):
     QUEUED = "queued"
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobPriority(str, Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
 
+DEFAULT_JOB_TTL = 3600.0
+DEFAULT_MAX_JOBS = 10000
+DEFAULT_SWEEP_INTERVAL = 60.0
+DEFAULT_LEASE_DURATION = 300.0
+DEFAULT_RESULT_CACHE_TTL = 0.0
+DEFAULT_PRIORITY_WEIGHTS = {JobPriority.INTERACTIVE: 4.0, JobPriority.BATCH: 1.0}
 
-@dataclass
+
+@dataclass(slots=True)
 class Job:
     job_id: str
     prompt: str
@@ -25,42 +54,587 @@ class Job:
     result_url: Optional[str] = None
     result_template_id: Optional[str] = None
     error: Optional[str] = None
-    position: int = 0
+    client_id: str = ""
+    priority: JobPriority = JobPriority.INTERACTIVE
+    fair_tag: float = 0.0
+    sequence: int = 0
+    dedup_key: Optional[str] = None
+
+
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+def make_dedup_key(prompt: str, selected_template_id: Optional[str]) -> str:
+    normalized_prompt = " ".join(prompt.split()).casefold()
+    key = normalized_prompt + "\x00" + (selected_template_id or "")
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def as_utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # SQLite returns naive datetimes
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=datetime.UTC)
 
 
-class QueueManager:
+class SQLiteJobStore:
+    """
+    Durable copy of the job table in SQLite.
+
+    Writes are applied in order by a single background thread. A processing
+    job is leased by the store instance running it. Leases that are not
+    renewed expire, and the job is queued again by recover().
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        lease_duration: float = DEFAULT_LEASE_DURATION,
+    ) -> None:
+        self.session_factory = session_factory
+        self.lease_duration = lease_duration
+        self.owner = uuid.uuid4().hex
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="job-store"
+        )
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def save(self, job: Job) -> None:
+        """Schedule a write of the job's current state, leasing it if it is processing."""
+        fields = {
+            "job_id": job.job_id,
+            "prompt": job.prompt,
+            "selected_template_id": job.selected_template_id,
+            "status": job.status.value,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "completed_at": job.completed_at,
+            "result_url": job.result_url,
+            "result_template_id": job.result_template_id,
+            "error": job.error,
+            "client_id": job.client_id,
+            "priority": job.priority.value,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        }
+        if job.status == JobStatus.PROCESSING:
+            fields["lease_owner"] = self.owner
+            fields["lease_expires_at"] = self._lease_expiration()
+        future = self._executor.submit(self._save, fields)
+        future.add_done_callback(_log_store_error)
+
+    async def renew(self, job_ids: List[str]) -> None:
+        if job_ids:
+            await self._run(self._renew, job_ids, self._lease_expiration())
+
+    async def release(self) -> None:
+        """Queue this owner's processing jobs again, e.g. on shutdown."""
+        await self._run(self._release)
+
+    async def recover(self) -> List[Job]:
+        """Queue jobs with expired leases again and return all queued jobs, oldest first."""
+        return await self._run(self._recover, datetime.datetime.now(datetime.UTC))
+
+    async def prune(self, before: datetime.datetime) -> None:
+        await self._run(self._prune, before)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._executor.shutdown, True)
+
+    def _lease_expiration(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.UTC) + datetime.timedelta(
+            seconds=self.lease_duration
+        )
+
+    def _save(self, fields: Dict[str, Any]) -> None:
+        with self.session_factory() as session:
+            session.merge(JobRecord(**fields))
+            session.commit()
+
+    def _renew(self, job_ids: List[str], expires_at: datetime.datetime) -> None:
+        with self.session_factory() as session:
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.job_id.in_(job_ids))
+                .where(JobRecord.lease_owner == self.owner)
+                .values(lease_expires_at=expires_at)
+            )
+            session.commit()
+
+    def _release(self) -> None:
+        with self.session_factory() as session:
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.status == JobStatus.PROCESSING.value)
+                .where(JobRecord.lease_owner == self.owner)
+                .values(
+                    status=JobStatus.QUEUED.value,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            session.commit()
+
+    def _recover(self, now: datetime.datetime) -> List[Job]:
+        with self.session_factory() as session:
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.status == JobStatus.PROCESSING.value)
+                .where(JobRecord.lease_expires_at < now)
+                .values(
+                    status=JobStatus.QUEUED.value,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            session.commit()
+            records = session.scalars(
+                select(JobRecord)
+                .where(JobRecord.status == JobStatus.QUEUED.value)
+                .order_by(JobRecord.created_at.asc())
+            ).all()
+            return [
+                Job(
+                    job_id=r.job_id,
+                    prompt=r.prompt,
+                    selected_template_id=r.selected_template_id,
+                    status=JobStatus.QUEUED,
+                    created_at=as_utc(r.created_at) or now,
+                    client_id=r.client_id or "",
+                    priority=JobPriority(r.priority or JobPriority.INTERACTIVE),
+                )
+                for r in records
+            ]
+
+    def _prune(self, before: datetime.datetime) -> None:
+        with self.session_factory() as session:
+            session.execute(
+                delete(JobRecord)
+                .where(JobRecord.status.in_([s.value for s in FINISHED_STATUSES]))
+                .where(JobRecord.completed_at < before)
+            )
+            session.commit()
+
+
+def _log_store_error(future: "Future[None]") -> None:
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Failed to persist job: {error}")
+
+
+class Subscription:
+    """
+    Change notification for one subscriber.
+
+    Notifications are coalesced: a woken subscriber reads the current
+    state from the QueueManager instead of receiving every transition.
+    """
+
+    def __init__(self, job_id: Optional[str]) -> None:
+        self.job_id = job_id
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+        self._changed.clear()
+
+
+class QueueBackend(ABC):
+    """
+    Job table and queue shared by the API endpoints and the workers.
+
+    QueueManager keeps them in process memory, SharedQueue in SQLite so that
+    several server and worker processes can use the same queue.
+    Subscriptions only see changes made in the same process; backends that
+    are changed by other processes notify subscribers periodically.
+    """
+
     def __init__(self) -> None:
-        self.queue: asyncio.Queue[Job] = asyncio.Queue()
+        self.coalesced_count = 0
+        self.result_cache_hits = 0
+        # Finished jobs dropped from the job table after JOB_TTL_SECONDS or MAX_JOBS
+        self.evicted_count = 0
+        self.subscriptions: Set[Subscription] = set()
+        self.job_subscriptions: Dict[str, Set[Subscription]] = {}
+        self.running_tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+    @abstractmethod
+    async def submit(
+        self,
+        prompt: str,
+        selected_template_id: Optional[str] = None,
+        client_id: str = "",
+        priority: JobPriority = JobPriority.INTERACTIVE,
+    ) -> Tuple[Job, int]:
+        """
+        Create and enqueue a job, returns it with its queue position.
+
+        Jobs are scheduled fairly between clients, and interactive jobs get
+        a larger share than batch jobs according to the priority weights.
+        """
+
+    @abstractmethod
+    async def dequeue(self) -> Job:
+        """Wait for the next queued job."""
+
+    @abstractmethod
+    async def update_job_status(
+        self,
+        job_id: str,
+        status: JobStatus,
+        result_url: Optional[str] = None,
+        result_template_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def cancel(self, job_id: str) -> Optional[JobStatus]:
+        """
+        Cancel a queued or processing job, returns the status it had.
+
+        A queued job is taken out of line. A processing job's task is
+        cancelled if it runs in this process; otherwise the process running
+        it finds out on its next poll. Returns None for unknown and
+        finished jobs.
+        """
+
+    @abstractmethod
+    async def get_job(self, job_id: str) -> Optional[Job]:
+        pass
+
+    @abstractmethod
+    async def get_position(self, job: Job) -> int:
+        pass
+
+    @abstractmethod
+    async def get_queue_size(self) -> int:
+        pass
+
+    @abstractmethod
+    async def get_in_flight_count(self) -> int:
+        pass
+
+    @abstractmethod
+    async def recover_jobs(self) -> int:
+        """Queue interrupted jobs again, returns their number."""
+
+    @abstractmethod
+    async def run_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+        """Periodic maintenance, runs until cancelled."""
+
+    @abstractmethod
+    async def drain(self, timeout: float) -> None:
+        """Stop handing out jobs and wait up to timeout seconds for in-flight ones."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    def register_task(self, job_id: str, task: "asyncio.Task[None]") -> None:
+        """Remember the task processing a job, so that cancel() can stop it."""
+        self.running_tasks[job_id] = task
+
+    def unregister_task(self, job_id: str) -> None:
+        self.running_tasks.pop(job_id, None)
+
+    def _cancel_task(self, job_id: str) -> None:
+        task = self.running_tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    def get_upstream_calls_saved(self) -> int:
+        return self.coalesced_count + self.result_cache_hits
+
+    def subscribe(self, job_id: Optional[str] = None) -> Subscription:
+        """Get notified about queue size changes and, if job_id is set, that job's changes."""
+        subscription = Subscription(job_id)
+        self.subscriptions.add(subscription)
+        if job_id:
+            self.job_subscriptions.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+        if subscription.job_id:
+            job_subscriptions = self.job_subscriptions.get(subscription.job_id, set())
+            job_subscriptions.discard(subscription)
+            if not job_subscriptions:
+                self.job_subscriptions.pop(subscription.job_id, None)
+
+    def wake_subscribers(self) -> None:
+        """Wake every subscriber, so that it re-checks its state."""
+        self._notify_all()
+
+    def _notify_all(self) -> None:
+        for subscription in self.subscriptions:
+            subscription.notify()
+
+    def _notify_job(self, job_id: str) -> None:
+        for subscription in self.job_subscriptions.get(job_id, ()):
+            subscription.notify()
+
+
+class QueueManager(QueueBackend):
+    """
+    Job table and queue in process memory.
+
+    Finished jobs are evicted once they are older than job_ttl seconds or
+    when the table holds more than max_jobs jobs. Queued and processing
+    jobs are never evicted.
+
+    With a store, every state change is written through to it, so queued
+    and interrupted jobs survive a restart and are restored by recover_jobs().
+
+    Submitting a prompt and template that match a queued or processing job
+    of the same client and priority returns that job instead of a new one,
+    so a client never shares a job it could cancel with another client.
+    With result_cache_ttl > 0, a match with a job completed within that many
+    seconds returns that completed job, whose image keeps it resolvable
+    after eviction.
+
+    Queued jobs are ordered by a FairScheduler with one flow per client and
+    priority, so positions follow the order in which jobs will be dequeued
+    and may grow when a job of a quieter client is put ahead.
+    """
+
+    def __init__(
+        self,
+        job_ttl: float = DEFAULT_JOB_TTL,
+        max_jobs: int = DEFAULT_MAX_JOBS,
+        store: Optional[SQLiteJobStore] = None,
+        result_cache_ttl: float = DEFAULT_RESULT_CACHE_TTL,
+        priority_weights: Dict[JobPriority, float] = DEFAULT_PRIORITY_WEIGHTS,
+    ) -> None:
+        super().__init__()
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.store = store
+        self.result_cache_ttl = result_cache_ttl
+        self.priority_weights = priority_weights
+        self.active_job_ids: Dict[Tuple[str, str, JobPriority], str] = {}
+        self.result_cache: OrderedDict[str, Tuple[datetime.datetime, Job]] = (
+            OrderedDict()
+        )
+        self.draining = False
+        self.scheduler: FairScheduler[Job] = FairScheduler()
+        # Counts pushed jobs, removed ones make dequeue() find nothing and retry
+        self._scheduled = asyncio.Semaphore(0)
         self.jobs: Dict[str, Job] = {}
-        self.is_processing: bool = False
+        self.finished_jobs: OrderedDict[str, datetime.datetime] = OrderedDict()
+        self.in_flight: int = 0
 
     def create_job(
-        self, prompt: str, selected_template_id: Optional[str] = None
+        self,
+        prompt: str,
+        selected_template_id: Optional[str] = None,
+        client_id: str = "",
+        priority: JobPriority = JobPriority.INTERACTIVE,
     ) -> Job:
+        dedup_key = make_dedup_key(prompt, selected_template_id)
+        active_job_id = self.active_job_ids.get((dedup_key, client_id, priority))
+        active_job = self.jobs.get(active_job_id) if active_job_id else None
+        if active_job:
+            self.coalesced_count += 1
+            return active_job
+
+        now = datetime.datetime.now(datetime.UTC)
+        cached_job = self._get_cached_job(dedup_key, now)
+        if cached_job:
+            self.result_cache_hits += 1
+            return cached_job
+
         job_id = str(uuid.uuid4())
         job = Job(
             job_id=job_id,
             prompt=prompt,
             selected_template_id=selected_template_id,
             status=JobStatus.QUEUED,
-            created_at=datetime.datetime.now(datetime.UTC),
+            created_at=now,
+            client_id=client_id,
+            priority=priority,
+            dedup_key=dedup_key,
         )
+        self.active_job_ids[(dedup_key, client_id, priority)] = job_id
         self.jobs[job_id] = job
+        if self.store:
+            self.store.save(job)
+        if len(self.jobs) > self.max_jobs:
+            self.evict_finished_jobs()
         return job
 
+    async def submit(
+        self,
+        prompt: str,
+        selected_template_id: Optional[str] = None,
+        client_id: str = "",
+        priority: JobPriority = JobPriority.INTERACTIVE,
+    ) -> Tuple[Job, int]:
+        job = self.create_job(prompt, selected_template_id, client_id, priority)
+        return job, await self.enqueue(job)
+
+    def _get_cached_job(self, dedup_key: str, now: datetime.datetime) -> Optional[Job]:
+        if self.result_cache_ttl <= 0:
+            return None
+        expiration_time = now - datetime.timedelta(seconds=self.result_cache_ttl)
+        while self.result_cache:
+            completed_at = next(iter(self.result_cache.values()))[0]
+            if (
+                completed_at > expiration_time
+                and len(self.result_cache) <= self.max_jobs
+            ):
+                break
+            self.result_cache.popitem(last=False)
+        entry = self.result_cache.get(dedup_key)
+        if not entry:
+            return None
+        return entry[1]
+
+    def _release_dedup_key(self, job: Job) -> None:
+        if not job.dedup_key:
+            return
+        active_key = (job.dedup_key, job.client_id, job.priority)
+        if self.active_job_ids.get(active_key) == job.job_id:
+            del self.active_job_ids[active_key]
+
+    def evict_finished_jobs(self) -> int:
+        expiration_time = datetime.datetime.now(datetime.UTC) - datetime.timedelta(
+            seconds=self.job_ttl
+        )
+        evicted_count = 0
+        while self.finished_jobs:
+            job_id, completed_at = next(iter(self.finished_jobs.items()))
+            if len(self.jobs) <= self.max_jobs and completed_at > expiration_time:
+                break
+            self.finished_jobs.popitem(last=False)
+            self.jobs.pop(job_id, None)
+            evicted_count += 1
+        self.evicted_count += evicted_count
+        return evicted_count
+
+    async def run_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_finished_jobs()
+            if not self.store:
+                continue
+            try:
+                processing_ids = [
+                    job.job_id
+                    for job in self.jobs.values()
+                    if job.status == JobStatus.PROCESSING
+                ]
+                await self.store.renew(processing_ids)
+                await self.recover_jobs()
+                await self.store.prune(
+                    datetime.datetime.now(datetime.UTC)
+                    - datetime.timedelta(seconds=self.job_ttl)
+                )
+            except Exception as e:
+                logger.error(f"Job store sweep failed: {e}")
+
+    async def recover_jobs(self) -> int:
+        """Enqueue stored queued jobs this manager does not know about yet."""
+        if not self.store:
+            return 0
+        recovered_count = 0
+        for job in await self.store.recover():
+            if job.job_id in self.jobs:
+                continue
+            job.dedup_key = make_dedup_key(job.prompt, job.selected_template_id)
+            self.active_job_ids.setdefault(
+                (job.dedup_key, job.client_id, job.priority), job.job_id
+            )
+            self.jobs[job.job_id] = job
+            await self.enqueue(job)
+            recovered_count += 1
+        return recovered_count
+
+    async def drain(self, timeout: float) -> None:
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.in_flight and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def close(self) -> None:
+        if self.store:
+            await self.store.release()
+            await self.store.close()
+
     async def enqueue(self, job: Job) -> int:
-        await self.queue.put(job)
-        position = self.queue.qsize()
-        job.position = position
-        return position
+        # Coalesced and cached jobs are already enqueued or finished
+        if job.sequence or job.status != JobStatus.QUEUED:
+            return self._get_position(job)
+        job.fair_tag, job.sequence = self.scheduler.push(
+            job,
+            (job.priority, job.client_id),
+            self.priority_weights.get(job.priority, 1.0),
+        )
+        self._scheduled.release()
+        self._notify_all()
+        return self._get_position(job)
 
-    def get_job(self, job_id: str) -> Optional[Job]:
+    async def dequeue(self) -> Job:
+        while True:
+            if self.draining:
+                # Workers park here until cancelled, queued jobs stay in the store
+                await asyncio.get_running_loop().create_future()
+            await self._scheduled.acquire()
+            if self.draining:
+                continue
+            job = self.scheduler.pop()
+            if job is not None:
+                break
+        self._notify_all()
+        return job
+
+    def discard(self, job_id: str) -> bool:
+        """Take a queued job out of line, it will not be dequeued."""
+        job = self.jobs.get(job_id)
+        if not job or job.status != JobStatus.QUEUED:
+            return False
+        if not self.scheduler.remove((job.fair_tag, job.sequence)):
+            return False
+        self._release_dedup_key(job)
+        self._notify_all()
+        return True
+
+    async def cancel(self, job_id: str) -> Optional[JobStatus]:
+        job = self.jobs.get(job_id)
+        if not job or job.status in FINISHED_STATUSES:
+            return None
+        previous_status = job.status
+        if previous_status == JobStatus.QUEUED:
+            self.discard(job_id)
+        await self.update_job_status(job_id, JobStatus.CANCELLED)
+        self._cancel_task(job_id)
+        return previous_status
+
+    async def get_position(self, job: Job) -> int:
+        return self._get_position(job)
+
+    def _get_position(self, job: Job) -> int:
+        if job.status != JobStatus.QUEUED:
+            return 0
+        return self.scheduler.get_position((job.fair_tag, job.sequence))
+
+    async def get_job(self, job_id: str) -> Optional[Job]:
         return self.jobs.get(job_id)
 
-    def get_queue_size(self) -> int:
-        return self.queue.qsize()
+    async def get_queue_size(self) -> int:
+        return len(self.scheduler)
+
+    async def get_in_flight_count(self) -> int:
+        return self.in_flight
 
-    def update_job_status(
+    async def update_job_status(
         self,
         job_id: str,
         status: JobStatus,
@@ -69,15 +643,40 @@ class QueueManager:
         error: Optional[str] = None,
     ) -> None:
         job = self.jobs.get(job_id)
+        if job and job.status == JobStatus.CANCELLED:
+            # A cancelled job keeps its status whatever its worker reports
+            return
         if job:
+            in_flight = self.in_flight
+            if job.status != JobStatus.PROCESSING and status == JobStatus.PROCESSING:
+                self.in_flight += 1
+            elif job.status == JobStatus.PROCESSING and status != JobStatus.PROCESSING:
+                self.in_flight -= 1
             job.status = status
             if status == JobStatus.PROCESSING:
                 job.started_at = datetime.datetime.now(datetime.UTC)
-            elif status in (JobStatus.COMPLETED, JobStatus.FAILED):
+            elif status in FINISHED_STATUSES:
                 job.completed_at = datetime.datetime.now(datetime.UTC)
+                self.finished_jobs[job_id] = job.completed_at
+                self._release_dedup_key(job)
             if result_url:
                 job.result_url = result_url
             if result_template_id:
                 job.result_template_id = result_template_id
             if error:
                 job.error = error
+            if (
+                status == JobStatus.COMPLETED
+                and job.result_url
+                and job.dedup_key
+                and job.completed_at
+                and self.result_cache_ttl > 0
+            ):
+                self.result_cache.pop(job.dedup_key, None)
+                self.result_cache[job.dedup_key] = (job.completed_at, job)
+            if self.store:
+                self.store.save(job)
+            if in_flight != self.in_flight:
+                self._notify_all()
+            else:
+                self._notify_job(job_id)
@@ -0,0 +1,80 @@
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from sortedcontainers import SortedList  # type: ignore
+
+T = TypeVar("T")
+
+ScheduleKey = Tuple[float, int]
+
+
+def get_finish_tag(
+    virtual_time: float, flow_tag: Optional[float], weight: float
+) -> float:
+    """Virtual finish time of a flow's next item, each item costs 1 / weight."""
+    start_tag = virtual_time if flow_tag is None else max(virtual_time, flow_tag)
+    return start_tag + 1.0 / weight
+
+
+class FairScheduler(Generic[T]):
+    """
+    Weighted fair queuing of items across flows.
+
+    Every item gets a virtual finish tag, `get_finish_tag` of its flow's
+    previous tag, and items are served in tag order. A flow with weight w
+    gets w times the share of a flow with weight 1 while both are busy, and
+    a new item of a quiet flow is served after about one item of every busy
+    flow instead of after their whole backlog. The virtual time is the tag
+    of the last served item, so an idle flow does not build up credit.
+
+    The scheduled keys are kept in a SortedList, which pushes, pops,
+    removes and finds an item's position in O(log n).
+    """
+
+    def __init__(self) -> None:
+        self.virtual_time = 0.0
+        self.flow_tags: Dict[Hashable, float] = {}
+        self.items: Dict[ScheduleKey, T] = {}
+        self._keys = SortedList()
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def push(self, item: T, flow: Hashable, weight: float = 1.0) -> ScheduleKey:
+        finish_tag = get_finish_tag(self.virtual_time, self.flow_tags.get(flow), weight)
+        self.flow_tags[flow] = finish_tag
+        self._sequence += 1
+        key = (finish_tag, self._sequence)
+        self.items[key] = item
+        self._keys.add(key)
+        return key
+
+    def pop(self) -> Optional[T]:
+        if not self._keys:
+            return None
+        key: ScheduleKey = self._keys.pop(0)
+        item = self.items.pop(key)
+        self.virtual_time = key[0]
+        self._prune_flow_tags()
+        return item
+
+    def remove(self, key: ScheduleKey) -> bool:
+        if self.items.pop(key, None) is None:
+            return False
+        self._keys.remove(key)
+        return True
+
+    def get_position(self, key: ScheduleKey) -> int:
+        """1-based position in the serving order, 0 if the key is not scheduled."""
+        if key not in self.items:
+            return 0
+        position: int = self._keys.index(key) + 1
+        return position
+
+    def _prune_flow_tags(self) -> None:
+        # Tags at or behind the virtual time no longer affect new items
+        if len(self.flow_tags) <= 2 * len(self.items) + 64:
+            return
+        self.flow_tags = {
+            flow: tag for flow, tag in self.flow_tags.items() if tag > self.virtual_time
+        }
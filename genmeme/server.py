@@ -1,10 +1,14 @@
 import os
+import signal
 import datetime
-import traceback
 import asyncio
-import json
+import threading
+import hashlib
 import logging
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict
+from functools import partial
+from types import FrameType
+from typing import Optional, Dict, Any, List, Set, Tuple, AsyncIterator
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -13,14 +17,47 @@ import uvicorn
 from pydantic import BaseModel
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from dotenv import load_dotenv
 
-from genmeme.files import STORAGE_PATH, PROMPT_PATH, TEMPLATES_PATH
-from genmeme.gen import generate_meme
-from genmeme.db import ImageRecord, SessionLocal
-from genmeme.queue import QueueManager, JobStatus
-from genmeme.thumbnails import create_thumbnail
+from genmeme.files import STORAGE_PATH, TEMPLATES_PATH
+from genmeme.llm import CIRCUIT_BREAKER, IMAGE_CACHE
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from genmeme.db import ImageRecord, IMAGE_STORE
+from genmeme.queue import (
+    QueueBackend,
+    QueueManager,
+    JobPriority,
+    JobStatus,
+    Job,
+    FINISHED_STATUSES,
+)
+from genmeme.shared_queue import SharedQueue
+from genmeme.thumbnails import get_thumbnail_name
+from genmeme.templates import get_template_registry
+from genmeme.pages import StaticPage, ImmutableStaticFiles, etag_matches
+from genmeme.metrics import REGISTRY, JOBS_CANCELLED, monitor_event_loop_lag
+from genmeme.admission import (
+    check_admission,
+    configure_admission_from_env,
+    get_client_id,
+)
+from genmeme.worker import (
+    DEFAULT_NUM_WORKERS,
+    DEFAULT_MAX_CONCURRENT_GENERATIONS,
+    DEFAULT_SHUTDOWN_DRAIN_SECONDS,
+    create_queue_from_env,
+    setup_generation,
+    shutdown_generation,
+    start_workers,
+)
 
 
 logger = logging.getLogger("uvicorn")
@@ -30,11 +67,78 @@ class EndpointFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         # Filter out queue size and job status polling endpoints
         message = record.getMessage()
-        return "/api/v1/queue/size" not in message and "/api/v1/job/" not in message
+        return (
+            "/api/v1/queue/size" not in message
+            and "/api/v1/job/" not in message
+            and "/metrics" not in message
+        )
 
 
-NUM_RETRIES = 5
-QUEUE_MANAGER = QueueManager()
+EVENTS_HEARTBEAT_INTERVAL = 15.0
+IMAGE_COUNT_SYNC_INTERVAL = 2.0
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_TEMPLATES_LIMIT = 20
+DEFAULT_GALLERY_CACHE_SIZE = 256
+MAX_TEMPLATES_LIMIT = 100
+DEFAULT_CANCEL_GRACE_SECONDS = 10.0
+# Cancellations started when an event stream subscriber goes away
+CANCELLATION_TASKS: Set["asyncio.Task[Optional[JobStatus]]"] = set()
+# Jobs whose last event stream went away, with the loop time it did
+ABANDONED_JOBS: Dict[str, float] = {}
+# Set once the server is asked to stop, open event streams end on it
+SHUTDOWN_EVENT = asyncio.Event()
+# Replaced in lifespan by the backend chosen with QUEUE_BACKEND
+QUEUE_MANAGER: QueueBackend = QueueManager()
+STATIC_DIR_PATH = Path(__file__).parent.parent / "static"
+INDEX_PAGE = StaticPage(
+    STATIC_DIR_PATH / "index.html", "<h1>MEMETRON 3000</h1><p>Frontend not found</p>"
+)
+GALLERY_PAGE = StaticPage(
+    STATIC_DIR_PATH / "gallery.html", "<h1>Gallery</h1><p>Gallery page not found</p>"
+)
+
+QUEUE_DEPTH = REGISTRY.gauge("genmeme_queue_depth", "Jobs waiting in the queue")
+JOBS_IN_FLIGHT = REGISTRY.gauge("genmeme_jobs_in_flight", "Jobs being processed")
+REGISTRY.gauge_callback(
+    "genmeme_circuit_open",
+    "1 if the upstream circuit breaker is open",
+    lambda: float(CIRCUIT_BREAKER.is_open),
+)
+REGISTRY.counter_callback(
+    "genmeme_image_cache_hits_total",
+    "Template image cache hits",
+    lambda: IMAGE_CACHE.hits,
+)
+REGISTRY.counter_callback(
+    "genmeme_image_cache_misses_total",
+    "Template image cache misses",
+    lambda: IMAGE_CACHE.misses,
+)
+REGISTRY.counter_callback(
+    "genmeme_result_cache_hits_total",
+    "Jobs answered from the result cache",
+    lambda: QUEUE_MANAGER.result_cache_hits,
+)
+REGISTRY.counter_callback(
+    "genmeme_coalesced_jobs_total",
+    "Submissions attached to an identical in-flight job",
+    lambda: QUEUE_MANAGER.coalesced_count,
+)
+REGISTRY.counter_callback(
+    "genmeme_jobs_evicted_total",
+    "Finished jobs removed from the job table by age or MAX_JOBS",
+    lambda: QUEUE_MANAGER.evicted_count,
+)
+REGISTRY.counter_callback(
+    "genmeme_image_inserts_total",
+    "Image records inserted by the database writer",
+    lambda: IMAGE_STORE.inserts_count,
+)
+REGISTRY.counter_callback(
+    "genmeme_image_commits_total",
+    "Transactions committed by the database writer, each with a batch of inserts",
+    lambda: IMAGE_STORE.commits_count,
+)
 
 
 class PredictRequest(BaseModel):
@@ -47,8 +151,17 @@ class PredictResponse(BaseModel):
     position: int
 
 
+class PredictBatchRequest(BaseModel):
+    items: List[PredictRequest]
+
+
+class PredictBatchResponse(BaseModel):
+    jobs: List[PredictResponse]
+
+
 class QueueSizeResponse(BaseModel):
     size: int
+    in_flight: int = 0
 
 
 class JobStatusResponse(BaseModel):
@@ -69,10 +182,17 @@ class TemplateInfo(BaseModel):
     description: str
 
 
+class ThumbnailInfo(BaseModel):
+    url: str
+    size: int
+    format: str
+
+
 class MemeInfo(BaseModel):
     result_id: str
     public_url: str
     thumbnail_url: Optional[str] = None
+    thumbnails: List[ThumbnailInfo] = []
     query: Optional[str] = None
     created_at: Optional[datetime.datetime] = None
     template_ids: Optional[str] = None
@@ -84,102 +204,124 @@ class GalleryResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: Optional[str] = None
 
 
 class ConfigResponse(BaseModel):
     generation_enabled: bool
 
 
-async def process_queue_worker() -> None:
+class StatsResponse(BaseModel):
+    coalesced_jobs: int
+    result_cache_hits: int
+    upstream_calls_saved: int
+    image_cache_hits: int
+    image_cache_misses: int
+    image_cache_bytes: int
+
+
+def get_thumbnail_infos(record: ImageRecord) -> List[ThumbnailInfo]:
+    if not record.thumbnail_variants:
+        return []
+    thumbnails = []
+    for variant in record.thumbnail_variants.split(","):
+        size, extension = variant.split(".")
+        thumbnail_name = get_thumbnail_name(record.public_url, variant)
+        thumbnails.append(
+            ThumbnailInfo(
+                url=f"output/thumbnails/{thumbnail_name}",
+                size=int(size),
+                format=extension,
+            )
+        )
+    return thumbnails
+
+
+async def sync_image_count(interval: float = IMAGE_COUNT_SYNC_INTERVAL) -> None:
+    # Other processes insert images too, recount so totals and caches follow
     while True:
-        job = await QUEUE_MANAGER.queue.get()
+        await asyncio.sleep(interval)
         try:
-            QUEUE_MANAGER.update_job_status(job.job_id, JobStatus.PROCESSING)
-            QUEUE_MANAGER.is_processing = True
-
-            generate_prompt_path = str(PROMPT_PATH)
-            env_prompt_path = os.getenv("PROMPT_PATH")
-            if env_prompt_path:
-                generate_prompt_path = env_prompt_path
-
-            templates_path = str(TEMPLATES_PATH)
-            env_templates_path = os.getenv("TEMPLATES_PATH")
-            if env_templates_path:
-                templates_path = env_templates_path
-
-            for attempt in range(NUM_RETRIES):
-                try:
-                    response = await generate_meme(
-                        job.prompt,
-                        generate_prompt_path=generate_prompt_path,
-                        templates_path=templates_path,
-                        selected_template_id=job.selected_template_id,
-                    )
-                    break
-                except Exception:
-                    if attempt == NUM_RETRIES - 1:
-                        raise
-                    traceback.print_exc()
-
-            public_url = f"output/{response.file_name}"
-
-            # Generate thumbnail
-            image_path = Path(STORAGE_PATH) / response.file_name
-            thumbnail_dir = Path(STORAGE_PATH) / "thumbnails"
-            thumbnail_dir.mkdir(exist_ok=True)
-            thumbnail_name = response.file_name
-            thumbnail_path = thumbnail_dir / thumbnail_name
-            thumbnail_url = f"output/thumbnails/{thumbnail_name}"
+            await IMAGE_STORE.sync_count()
+        except Exception as e:
+            logger.error(f"Image count sync failed: {e}")
 
-            try:
-                create_thumbnail(image_path, thumbnail_path)
-            except Exception as e:
-                logger.error(f"Failed to create thumbnail: {e}")
-                thumbnail_url = public_url
 
-            logger.info(
-                f'OUTPUT job_id="{job.job_id}" file="{response.file_name}" templates="{",".join(response.template_ids)}"'
-            )
+def stop_event_streams() -> None:
+    SHUTDOWN_EVENT.set()
+    QUEUE_MANAGER.wake_subscribers()
 
-            db = SessionLocal()
-            db_record = ImageRecord(
-                result_id=response.file_name.split(".")[0],
-                public_url=public_url,
-                thumbnail_url=thumbnail_url,
-                query=job.prompt,
-                created_at=datetime.datetime.now(datetime.UTC),
-                template_ids=",".join(response.template_ids),
-            )
-            db.add(db_record)
-            db.commit()
-            db.close()
-
-            QUEUE_MANAGER.update_job_status(
-                job.job_id,
-                JobStatus.COMPLETED,
-                result_url=public_url,
-            )
 
-        except Exception as e:
-            error_msg = str(e)
-            traceback.print_exc()
-            QUEUE_MANAGER.update_job_status(
-                job.job_id, JobStatus.FAILED, error=error_msg
-            )
-        finally:
-            QUEUE_MANAGER.is_processing = False
-            QUEUE_MANAGER.queue.task_done()
+def install_shutdown_hook(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    End event streams as soon as the server gets SIGINT or SIGTERM.
+
+    The server waits for open connections before running the lifespan
+    shutdown, and an event stream stays open for as long as its client
+    listens. The server's own signal handlers still run afterwards.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous_handler = signal.getsignal(sig)
+        if not callable(previous_handler):
+            continue
+
+        def handle_exit(
+            signum: int,
+            frame: Optional[FrameType],
+            previous_handler: Any = previous_handler,
+        ) -> None:
+            loop.call_soon_threadsafe(stop_event_streams)
+            previous_handler(signum, frame)
+
+        signal.signal(sig, handle_exit)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):  # type: ignore
-    task = asyncio.create_task(process_queue_worker())
+    global QUEUE_MANAGER
+    SHUTDOWN_EVENT.clear()
+    install_shutdown_hook(asyncio.get_running_loop())
+    QUEUE_MANAGER = create_queue_from_env()
+    shared = isinstance(QUEUE_MANAGER, SharedQueue)
+    setup_generation()
+    configure_admission_from_env()
+    INDEX_PAGE.refresh()
+    GALLERY_PAGE.refresh()
+    num_workers = int(os.getenv("NUM_WORKERS", DEFAULT_NUM_WORKERS))
+    max_concurrent_generations = int(
+        os.getenv("MAX_CONCURRENT_GENERATIONS", DEFAULT_MAX_CONCURRENT_GENERATIONS)
+    )
+    if shared or os.getenv("PERSISTENT_QUEUE", "false").lower() == "true":
+        recovered_count = await QUEUE_MANAGER.recover_jobs()
+        logger.info(f"Persistent queue enabled, recovered {recovered_count} jobs")
+    background_tasks = [
+        asyncio.create_task(QUEUE_MANAGER.run_sweeper()),
+        asyncio.create_task(monitor_event_loop_lag()),
+    ]
+    if shared:
+        background_tasks.append(asyncio.create_task(sync_image_count()))
+    # With a shared queue, standalone worker processes may do all the work
+    tasks = start_workers(
+        QUEUE_MANAGER,
+        max(0 if shared else 1, num_workers),
+        max_concurrent_generations,
+    )
+    logger.info(
+        f"Started {len(tasks)} queue workers, max {max_concurrent_generations} concurrent generations"
+    )
     yield
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    for cancellation_task in list(CANCELLATION_TASKS):
+        cancellation_task.cancel()
+    await QUEUE_MANAGER.drain(
+        float(os.getenv("SHUTDOWN_DRAIN_SECONDS", DEFAULT_SHUTDOWN_DRAIN_SECONDS))
+    )
+    for task in background_tasks + tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, *tasks, return_exceptions=True)
+    await QUEUE_MANAGER.close()
+    await shutdown_generation()
 
 
 APP = FastAPI(lifespan=lifespan)
@@ -193,37 +335,72 @@ def get_base_url(request: Request) -> str:
     return f"{forwarded_proto}://{forwarded_host}"
 
 
-@APP.post("/api/v1/predict", response_model=PredictResponse)
-async def predict(request: PredictRequest, req: Request) -> PredictResponse:
+def check_generation_enabled() -> None:
     generation_enabled = os.getenv("ENABLE_GENERATION", "false").lower() == "true"
     if not generation_enabled:
         raise HTTPException(
             status_code=503, detail="Meme generation is currently disabled"
         )
-    job = QUEUE_MANAGER.create_job(request.prompt, request.selected_template_id)
-    position = await QUEUE_MANAGER.enqueue(job)
+
+
+async def submit_job(
+    request: PredictRequest,
+    client_id: str,
+    priority: JobPriority = JobPriority.INTERACTIVE,
+) -> PredictResponse:
+    job, position = await QUEUE_MANAGER.submit(
+        request.prompt, request.selected_template_id, client_id, priority
+    )
     logger.info(
         f'QUERY job_id="{job.job_id}" template="{request.selected_template_id or "random"}" prompt="{request.prompt[:100]}"'
     )
     return PredictResponse(job_id=job.job_id, position=position)
 
 
+@APP.post("/api/v1/predict", response_model=PredictResponse)
+async def predict(request: PredictRequest, req: Request) -> PredictResponse:
+    check_generation_enabled()
+    client_id = get_client_id(req)
+    check_admission(client_id, await QUEUE_MANAGER.get_queue_size())
+    return await submit_job(request, client_id)
+
+
+@APP.post("/api/v1/predict/batch", response_model=PredictBatchResponse)
+async def predict_batch(
+    request: PredictBatchRequest, req: Request
+) -> PredictBatchResponse:
+    check_generation_enabled()
+    max_batch_size = int(os.getenv("MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE))
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(request.items) > max_batch_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch is too large, at most {max_batch_size} items are allowed",
+        )
+    client_id = get_client_id(req)
+    check_admission(client_id, await QUEUE_MANAGER.get_queue_size(), len(request.items))
+    # Batch jobs get a smaller share of the workers than interactive ones
+    return PredictBatchResponse(
+        jobs=[
+            await submit_job(item, client_id, JobPriority.BATCH)
+            for item in request.items
+        ]
+    )
+
+
 @APP.get("/api/v1/queue/size", response_model=QueueSizeResponse)
 async def get_queue_size() -> QueueSizeResponse:
-    size = QUEUE_MANAGER.get_queue_size()
-    return QueueSizeResponse(size=size)
+    size = await QUEUE_MANAGER.get_queue_size()
+    in_flight = await QUEUE_MANAGER.get_in_flight_count()
+    return QueueSizeResponse(size=size, in_flight=in_flight)
 
 
-@APP.get("/api/v1/job/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str) -> JobStatusResponse:
-    job = QUEUE_MANAGER.get_job(job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-
+async def make_job_status_response(job: Job) -> JobStatusResponse:
     return JobStatusResponse(
         job_id=job.job_id,
         status=job.status,
-        position=job.position,
+        position=await QUEUE_MANAGER.get_position(job),
         created_at=job.created_at,
         selected_template_id=job.selected_template_id,
         started_at=job.started_at,
@@ -233,89 +410,355 @@ async def get_job_status(job_id: str) -> JobStatusResponse:
     )
 
 
+async def find_evicted_job_status(job_id: str) -> Optional[JobStatusResponse]:
+    # Completed jobs evicted from the queue manager are found by their image
+    def query_record(db: Session) -> Optional[ImageRecord]:
+        return db.query(ImageRecord).filter(ImageRecord.job_id == job_id).first()
+
+    record = await IMAGE_STORE.run(query_record)
+    if record is None:
+        return None
+    return JobStatusResponse(
+        job_id=job_id,
+        status=JobStatus.COMPLETED,
+        position=0,
+        created_at=record.created_at,
+        completed_at=record.created_at,
+        result_url=record.public_url,
+    )
+
+
+@APP.get("/api/v1/job/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str) -> JobStatusResponse:
+    # A client polling after its stream was cut still wants the job
+    ABANDONED_JOBS.pop(job_id, None)
+    job = await QUEUE_MANAGER.get_job(job_id)
+    if job:
+        return await make_job_status_response(job)
+
+    response = await find_evicted_job_status(job_id)
+    if not response:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return response
+
+
+async def cancel_job_by_client(queue: QueueBackend, job_id: str) -> Optional[JobStatus]:
+    previous_status = await queue.cancel(job_id)
+    if previous_status is not None:
+        JOBS_CANCELLED.inc(status=previous_status.value)
+        logger.info(f'CANCEL job_id="{job_id}" status="{previous_status.value}"')
+    return previous_status
+
+
+@APP.delete("/api/v1/job/{job_id}", response_model=JobStatusResponse)
+async def cancel_job(job_id: str) -> JobStatusResponse:
+    if await cancel_job_by_client(QUEUE_MANAGER, job_id) is None:
+        if await QUEUE_MANAGER.get_job(job_id) or await find_evicted_job_status(job_id):
+            raise HTTPException(status_code=409, detail="Job is already finished")
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = await QUEUE_MANAGER.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await make_job_status_response(job)
+
+
+def cancel_abandoned_job(queue: QueueBackend, job_id: str) -> None:
+    # Called while the stream is being torn down, so the work goes to a task
+    abandoned_at = asyncio.get_running_loop().time()
+    ABANDONED_JOBS[job_id] = abandoned_at
+    task = asyncio.create_task(cancel_after_grace(queue, job_id, abandoned_at))
+    CANCELLATION_TASKS.add(task)
+    task.add_done_callback(CANCELLATION_TASKS.discard)
+
+
+async def cancel_after_grace(
+    queue: QueueBackend, job_id: str, abandoned_at: float
+) -> Optional[JobStatus]:
+    """
+    Cancel an abandoned job unless its client comes back within CANCEL_GRACE_SECONDS.
+
+    A status poll or a new event stream for the job takes it out of
+    ABANDONED_JOBS, so a client that lost its stream to a network error
+    and fell back to polling keeps its job.
+    """
+    await asyncio.sleep(
+        float(os.getenv("CANCEL_GRACE_SECONDS", DEFAULT_CANCEL_GRACE_SECONDS))
+    )
+    if ABANDONED_JOBS.get(job_id) != abandoned_at:
+        return None
+    del ABANDONED_JOBS[job_id]
+    if SHUTDOWN_EVENT.is_set() or job_id in queue.job_subscriptions:
+        return None
+    return await cancel_job_by_client(queue, job_id)
+
+
+def format_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def stream_events(job_id: Optional[str] = None) -> AsyncIterator[str]:
+    # Sends current state on every change notification, skipping unchanged payloads
+    queue = QUEUE_MANAGER
+    subscription = queue.subscribe(job_id)
+    if job_id:
+        ABANDONED_JOBS.pop(job_id, None)
+    last_queue_data: Optional[str] = None
+    last_job_data: Optional[str] = None
+    job_finished = False
+    try:
+        while True:
+            queue_data = (await get_queue_size()).model_dump_json()
+            if queue_data != last_queue_data:
+                yield format_event("queue", queue_data)
+                last_queue_data = queue_data
+
+            if job_id:
+                job = await queue.get_job(job_id)
+                if not job:
+                    response = await find_evicted_job_status(job_id)
+                    if response:
+                        yield format_event("job", response.model_dump_json())
+                    else:
+                        yield format_event("missing", '{"detail":"Job not found"}')
+                    job_finished = True
+                    return
+                job_data = (await make_job_status_response(job)).model_dump_json()
+                if job_data != last_job_data:
+                    yield format_event("job", job_data)
+                    last_job_data = job_data
+                if job.status in FINISHED_STATUSES:
+                    job_finished = True
+                    return
+
+            try:
+                await asyncio.wait_for(
+                    subscription.wait(), timeout=EVENTS_HEARTBEAT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+            if SHUTDOWN_EVENT.is_set():
+                # Ended by the server, the job is left to be requeued
+                job_finished = True
+                return
+    finally:
+        queue.unsubscribe(subscription)
+        # The stream ended early, so its client went away
+        if (
+            job_id
+            and not job_finished
+            and not SHUTDOWN_EVENT.is_set()
+            and os.getenv("CANCEL_ON_DISCONNECT", "false").lower() == "true"
+            and job_id not in queue.job_subscriptions
+        ):
+            cancel_abandoned_job(queue, job_id)
+
+
+def make_event_stream_response(job_id: Optional[str] = None) -> StreamingResponse:
+    return StreamingResponse(
+        stream_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@APP.get("/api/v1/job/{job_id}/events")
+async def get_job_events(job_id: str) -> StreamingResponse:
+    job = await QUEUE_MANAGER.get_job(job_id)
+    if not job and not await find_evicted_job_status(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return make_event_stream_response(job_id)
+
+
+@APP.get("/api/v1/queue/events")
+async def get_queue_events() -> StreamingResponse:
+    return make_event_stream_response()
+
+
 @APP.get("/api/v1/templates", response_model=List[TemplateInfo])
-async def get_templates() -> List[TemplateInfo]:
+async def get_templates(
+    request: Request,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Response:
     templates_path = str(TEMPLATES_PATH)
     env_templates_path = os.getenv("TEMPLATES_PATH")
     if env_templates_path:
         templates_path = env_templates_path
 
-    templates_data = json.loads(Path(templates_path).read_text())
-    # Filter to only include image templates, not video
-    image_templates = [t for t in templates_data if t.get("type", "image") == "image"]
-    return [
-        TemplateInfo(
-            id=t["id"],
-            name=t["name"],
-            description=t.get("description", ""),
-        )
-        for t in image_templates
-    ]
+    registry = get_template_registry(templates_path)
+    if q is not None or limit is not None or offset:
+        # Search and pagination go through the index, rebuilt on file change
+        limit = max(1, min(MAX_TEMPLATES_LIMIT, limit or DEFAULT_TEMPLATES_LIMIT))
+        total, templates = registry.search(q or "", limit=limit, offset=max(0, offset))
+        infos = [
+            TemplateInfo(
+                id=t["id"], name=t["name"], description=t.get("description", "")
+            ).model_dump()
+            for t in templates
+        ]
+        return JSONResponse(infos, headers={"X-Total-Count": str(total)})
+
+    # The full list of image templates is serialized once per file change
+    headers = {"ETag": registry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), [registry.etag]):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=registry.image_templates_body,
+        media_type="application/json",
+        headers=headers,
+    )
 
 
-@APP.get("/api/v1/gallery", response_model=GalleryResponse)
-async def get_gallery(page: int = 1, page_size: int = 24) -> GalleryResponse:
-    db = SessionLocal()
+GalleryCacheKey = Tuple[int, int, Optional[str]]
+
+
+class GalleryCache:
+    """
+    Serialized gallery pages with their ETags.
+
+    Entries are valid for one IMAGE_STORE generation, an insert invalidates them all.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_GALLERY_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self.generation = -1
+        self.hits = 0
+        self.misses = 0
+        self.pages: OrderedDict[GalleryCacheKey, Tuple[bytes, str]] = OrderedDict()
+
+    def get(self, key: GalleryCacheKey, generation: int) -> Optional[Tuple[bytes, str]]:
+        if generation != self.generation:
+            self.pages.clear()
+            self.generation = generation
+        page = self.pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self.pages.move_to_end(key)
+        self.hits += 1
+        return page
+
+    def put(self, key: GalleryCacheKey, generation: int, body: bytes) -> str:
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        # A page built before a concurrent insert is not cached
+        if generation == self.generation:
+            self.pages[key] = (body, etag)
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
+        return etag
+
+
+GALLERY_CACHE = GalleryCache()
+REGISTRY.counter_callback(
+    "genmeme_gallery_cache_hits_total",
+    "Gallery pages served from the cache",
+    lambda: GALLERY_CACHE.hits,
+)
+
+
+def parse_gallery_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
     try:
-        # Ensure valid pagination parameters
-        page = max(1, page)
-        page_size = max(1, min(100, page_size))  # Max 100 items per page
-
-        # Get total count
-        total = db.query(ImageRecord).count()
-
-        # Calculate total pages
-        total_pages = (total + page_size - 1) // page_size if total > 0 else 1
-
-        # Get paginated records
-        offset = (page - 1) * page_size
-        records = (
-            db.query(ImageRecord)
-            .order_by(ImageRecord.created_at.asc())
-            .limit(page_size)
-            .offset(offset)
-            .all()
+        # The timestamp never contains a comma, a result_id might
+        created_at, result_id = cursor.split(",", 1)
+        return datetime.datetime.fromisoformat(created_at), result_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def make_gallery_cursor(record: ImageRecord) -> Optional[str]:
+    if record.created_at is None:
+        return None
+    return f"{record.created_at.isoformat()},{record.result_id}"
+
+
+def query_gallery_page(
+    page: int,
+    page_size: int,
+    cursor: Optional[Tuple[datetime.datetime, str]],
+    db: Session,
+) -> GalleryResponse:
+    # Total count is maintained by the store on insert
+    total = IMAGE_STORE.get_count()
+
+    # Calculate total pages
+    total_pages = (total + page_size - 1) // page_size if total > 0 else 1
+
+    # Get paginated records, either after a cursor or by page number
+    query = db.query(ImageRecord).order_by(
+        ImageRecord.created_at.asc(), ImageRecord.result_id.asc()
+    )
+    if cursor:
+        query = query.filter(
+            tuple_(ImageRecord.created_at, ImageRecord.result_id) > tuple_(*cursor)
+        )
+    else:
+        query = query.offset((page - 1) * page_size)
+    records = query.limit(page_size).all()
+
+    memes = [
+        MemeInfo(
+            result_id=r.result_id,
+            public_url=r.public_url,
+            thumbnail_url=r.thumbnail_url or r.public_url,
+            thumbnails=get_thumbnail_infos(r),
+            query=r.query,
+            created_at=r.created_at,
+            template_ids=r.template_ids,
         )
+        for r in records
+    ]
+
+    next_cursor = None
+    if len(records) == page_size:
+        next_cursor = make_gallery_cursor(records[-1])
+
+    return GalleryResponse(
+        memes=memes,
+        total=total,
+        page=page,
+        page_size=page_size,
+        total_pages=total_pages,
+        next_cursor=next_cursor,
+    )
 
-        memes = [
-            MemeInfo(
-                result_id=r.result_id,
-                public_url=r.public_url,
-                thumbnail_url=r.thumbnail_url or r.public_url,
-                query=r.query,
-                created_at=r.created_at,
-                template_ids=r.template_ids,
-            )
-            for r in records
-        ]
 
-        return GalleryResponse(
-            memes=memes,
-            total=total,
-            page=page,
-            page_size=page_size,
-            total_pages=total_pages,
+@APP.get("/api/v1/gallery", response_model=GalleryResponse)
+async def get_gallery(
+    request: Request, page: int = 1, page_size: int = 24, after: Optional[str] = None
+) -> Response:
+    # Ensure valid pagination parameters
+    page = max(1, page)
+    page_size = max(1, min(100, page_size))  # Max 100 items per page
+    cursor = parse_gallery_cursor(after) if after else None
+
+    # Pages change only when an image is inserted
+    cache_key = (page, page_size, after)
+    generation = IMAGE_STORE.generation
+    cached_page = GALLERY_CACHE.get(cache_key, generation)
+    if cached_page is None:
+        gallery_response = await IMAGE_STORE.run(
+            partial(query_gallery_page, page, page_size, cursor)
         )
-    finally:
-        db.close()
+        body = gallery_response.model_dump_json().encode("utf-8")
+        etag = GALLERY_CACHE.put(cache_key, generation, body)
+    else:
+        body, etag = cached_page
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), [etag]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @APP.get("/", response_class=HTMLResponse)
-async def root() -> str:
-    static_dir = Path(__file__).parent.parent / "static"
-    index_path = static_dir / "index.html"
-    if index_path.exists():
-        return index_path.read_text()
-    return "<h1>MEMETRON 3000</h1><p>Frontend not found</p>"
+async def root(request: Request) -> Response:
+    return INDEX_PAGE.get_response(request)
 
 
 @APP.get("/gallery", response_class=HTMLResponse)
-async def gallery() -> str:
-    static_dir = Path(__file__).parent.parent / "static"
-    gallery_path = static_dir / "gallery.html"
-    if gallery_path.exists():
-        return gallery_path.read_text()
-    return "<h1>Gallery</h1><p>Gallery page not found</p>"
+async def gallery(request: Request) -> Response:
+    return GALLERY_PAGE.get_response(request)
 
 
 @APP.get("/api/v1/config", response_model=ConfigResponse)
@@ -324,23 +767,48 @@ async def get_config() -> ConfigResponse:
     return ConfigResponse(generation_enabled=generation_enabled)
 
 
+@APP.get("/api/v1/stats", response_model=StatsResponse)
+async def get_stats() -> StatsResponse:
+    return StatsResponse(
+        coalesced_jobs=QUEUE_MANAGER.coalesced_count,
+        result_cache_hits=QUEUE_MANAGER.result_cache_hits,
+        upstream_calls_saved=QUEUE_MANAGER.get_upstream_calls_saved(),
+        image_cache_hits=IMAGE_CACHE.hits,
+        image_cache_misses=IMAGE_CACHE.misses,
+        image_cache_bytes=IMAGE_CACHE.current_bytes,
+    )
+
+
+@APP.get("/metrics")
+async def get_metrics() -> Response:
+    QUEUE_DEPTH.set(await QUEUE_MANAGER.get_queue_size())
+    JOBS_IN_FLIGHT.set(await QUEUE_MANAGER.get_in_flight_count())
+    return Response(
+        content=REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 @APP.get("/health")
 async def health_check() -> Dict[str, Any]:
     return {"status": "healthy", "timestamp": datetime.datetime.utcnow().isoformat()}
 
 
-APP.mount("/output", StaticFiles(directory=STORAGE_PATH), name="output")
-APP.mount(
-    "/static",
-    StaticFiles(directory=str(Path(__file__).parent.parent / "static")),
-    name="static",
-)
+# Generated images and thumbnails have unique names and are never rewritten
+APP.mount("/output", ImmutableStaticFiles(directory=STORAGE_PATH), name="output")
+APP.mount("/static", StaticFiles(directory=str(STATIC_DIR_PATH)), name="static")
 
 
-def main(host: str = "0.0.0.0", port: int = 8090) -> None:
+def main(host: str = "0.0.0.0", port: int = 8090, workers: int = 1) -> None:
     # Add filter to uvicorn access logger to exclude polling endpoints
     logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
-    uvicorn.run(APP, host=host, port=port)
+    if workers <= 1:
+        uvicorn.run(APP, host=host, port=port)
+        return
+    # Server processes only share jobs through the SQLite queue
+    if os.getenv("QUEUE_BACKEND", "memory").lower() != "sqlite":
+        raise ValueError("Several server processes need QUEUE_BACKEND=sqlite")
+    uvicorn.run("genmeme.server:APP", host=host, port=port, workers=workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,622 @@
+import asyncio
+import datetime
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from genmeme.db import JobRecord, SessionLocal
+from genmeme.queue import (
+    DEFAULT_JOB_TTL,
+    DEFAULT_LEASE_DURATION,
+    DEFAULT_PRIORITY_WEIGHTS,
+    DEFAULT_RESULT_CACHE_TTL,
+    DEFAULT_SWEEP_INTERVAL,
+    FINISHED_STATUSES,
+    Job,
+    JobPriority,
+    JobStatus,
+    QueueBackend,
+    as_utc,
+    make_dedup_key,
+)
+from genmeme.scheduler import get_finish_tag
+
+T = TypeVar("T")
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_QUEUE_THREADS = 4
+
+ACTIVE_STATUSES = (JobStatus.QUEUED.value, JobStatus.PROCESSING.value)
+
+
+@dataclass
+class QueueSnapshot:
+    """Queue size and the state of the jobs subscribers watch, read at once."""
+
+    taken_at: float = 0.0
+    queue_size: int = 0
+    in_flight: int = 0
+    jobs: Dict[str, Job] = field(default_factory=dict)
+    positions: Dict[str, int] = field(default_factory=dict)
+
+
+def record_to_job(record: JobRecord) -> Job:
+    return Job(
+        job_id=record.job_id,
+        prompt=record.prompt,
+        selected_template_id=record.selected_template_id,
+        status=JobStatus(record.status),
+        created_at=as_utc(record.created_at) or datetime.datetime.now(datetime.UTC),
+        started_at=as_utc(record.started_at),
+        completed_at=as_utc(record.completed_at),
+        result_url=record.result_url,
+        result_template_id=record.result_template_id,
+        error=record.error,
+        client_id=record.client_id or "",
+        priority=JobPriority(record.priority or JobPriority.INTERACTIVE),
+        fair_tag=record.fair_tag or 0.0,
+        dedup_key=record.dedup_key,
+    )
+
+
+class SharedQueue(QueueBackend):
+    """
+    Job table and queue in the SQLite `jobs` table, shared between processes.
+
+    Any number of server and worker processes on one host can use the same
+    database file. A worker claims the oldest queued job with a single
+    UPDATE, so a job is handed out once. Claimed jobs are leased by the
+    claiming process; leases are renewed by its sweeper and expired ones
+    are queued again by any process.
+
+    Jobs are scheduled by weighted fair queuing like in QueueManager: a new
+    job's finish tag is computed from the queued jobs of its client and
+    priority, with the tag of the most recently claimed job as the virtual
+    time. Jobs are claimed in (fair_tag, created_at, job_id) order and a
+    queued job's position is the number of queued jobs ahead of it plus one.
+    Coalescing of identical submissions of a client and priority, and the
+    result cache, which returns the completed job itself, work across
+    processes on a best-effort basis for submissions made at the same moment.
+
+    Queue sizes, and the jobs that event streams watch, are read from a
+    QueueSnapshot. The sweeper takes one per poll, and one is taken on
+    demand after a change made by this process. All subscribers share it,
+    so many open streams cost a few queries per poll, not a few per stream,
+    and subscribers are only woken when the snapshot shows a change.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        job_ttl: float = DEFAULT_JOB_TTL,
+        result_cache_ttl: float = DEFAULT_RESULT_CACHE_TTL,
+        lease_duration: float = DEFAULT_LEASE_DURATION,
+        priority_weights: Dict[JobPriority, float] = DEFAULT_PRIORITY_WEIGHTS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        threads: int = DEFAULT_QUEUE_THREADS,
+    ) -> None:
+        super().__init__()
+        self.session_factory = session_factory
+        self.job_ttl = job_ttl
+        self.result_cache_ttl = result_cache_ttl
+        self.lease_duration = lease_duration
+        self.priority_weights = priority_weights
+        self.poll_interval = poll_interval
+        self.owner = uuid.uuid4().hex
+        self.draining = False
+        self.processing_job_ids: Set[str] = set()
+        self._submitted = asyncio.Event()
+        self._snapshot: Optional[QueueSnapshot] = None
+        self._snapshot_version = 0
+        self._snapshot_refresh: Optional["asyncio.Future[None]"] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="shared-queue"
+        )
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _now(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.UTC)
+
+    def _lease_expiration(self) -> datetime.datetime:
+        return self._now() + datetime.timedelta(seconds=self.lease_duration)
+
+    async def submit(
+        self,
+        prompt: str,
+        selected_template_id: Optional[str] = None,
+        client_id: str = "",
+        priority: JobPriority = JobPriority.INTERACTIVE,
+    ) -> Tuple[Job, int]:
+        job, outcome = await self._run(
+            self._submit,
+            prompt,
+            selected_template_id,
+            client_id,
+            priority,
+            self._now(),
+        )
+        if outcome == "coalesced":
+            self.coalesced_count += 1
+        elif outcome == "cached":
+            self.result_cache_hits += 1
+        else:
+            self._submitted.set()
+            self._notify_changed()
+        return job, await self.get_position(job)
+
+    async def dequeue(self) -> Job:
+        while True:
+            if self.draining:
+                await asyncio.get_running_loop().create_future()
+            self._submitted.clear()
+            job = await self._run(self._claim, self._now(), self._lease_expiration())
+            if job is not None and not self.draining:
+                self.processing_job_ids.add(job.job_id)
+                self._notify_changed()
+                return job
+            if job is not None:
+                await self._run(self._requeue, [job.job_id])
+                continue
+            try:
+                # Jobs submitted by other processes are found by polling
+                await asyncio.wait_for(self._submitted.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def update_job_status(
+        self,
+        job_id: str,
+        status: JobStatus,
+        result_url: Optional[str] = None,
+        result_template_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        now = self._now()
+        values: Dict[str, Any] = {"status": status.value}
+        if status == JobStatus.PROCESSING:
+            values.update(
+                started_at=now,
+                lease_owner=self.owner,
+                lease_expires_at=self._lease_expiration(),
+            )
+            self.processing_job_ids.add(job_id)
+        else:
+            values.update(lease_owner=None, lease_expires_at=None)
+            self.processing_job_ids.discard(job_id)
+        if status in FINISHED_STATUSES:
+            values["completed_at"] = now
+        if result_url:
+            values["result_url"] = result_url
+        if result_template_id:
+            values["result_template_id"] = result_template_id
+        if error:
+            values["error"] = error
+        await self._run(self._update, job_id, values)
+        self._notify_changed()
+
+    async def cancel(self, job_id: str) -> Optional[JobStatus]:
+        previous_status = await self._run(self._cancel, job_id, self._now())
+        if previous_status is None:
+            return None
+        self._cancel_task(job_id)
+        self._notify_changed()
+        return previous_status
+
+    async def get_job(self, job_id: str) -> Optional[Job]:
+        if job_id in self.job_subscriptions:
+            job = (await self.get_snapshot()).jobs.get(job_id)
+            if job is not None:
+                return job
+        return await self._run(self._get_job, job_id)
+
+    async def get_position(self, job: Job) -> int:
+        if job.status != JobStatus.QUEUED:
+            return 0
+        snapshot = await self.get_snapshot()
+        if snapshot.jobs.get(job.job_id) is job:
+            return snapshot.positions.get(job.job_id, 0)
+        return await self._run(self._get_position, job)
+
+    async def get_queue_size(self) -> int:
+        return (await self.get_snapshot()).queue_size
+
+    async def get_in_flight_count(self) -> int:
+        return (await self.get_snapshot()).in_flight
+
+    async def get_snapshot(self) -> QueueSnapshot:
+        """The current snapshot, concurrent callers share one read of it."""
+        while self._snapshot is None or self._is_outdated(self._snapshot):
+            if self._snapshot_refresh is None:
+                self._snapshot_refresh = asyncio.ensure_future(self._refresh_snapshot())
+            await asyncio.shield(self._snapshot_refresh)
+        return self._snapshot
+
+    def _is_outdated(self, snapshot: QueueSnapshot) -> bool:
+        # Only reached if the sweeper stopped polling
+        age = asyncio.get_running_loop().time() - snapshot.taken_at
+        return age > 2 * self.poll_interval
+
+    async def _refresh_snapshot(self) -> None:
+        version = self._snapshot_version
+        try:
+            snapshot = await self._run(
+                self._take_snapshot, list(self.job_subscriptions)
+            )
+            snapshot.taken_at = asyncio.get_running_loop().time()
+        finally:
+            self._snapshot_refresh = None
+        # A snapshot read before a local change is dropped
+        if version == self._snapshot_version:
+            self._snapshot = snapshot
+
+    async def _poll_snapshot(self) -> None:
+        version = self._snapshot_version
+        snapshot = await self._run(self._take_snapshot, list(self.job_subscriptions))
+        snapshot.taken_at = asyncio.get_running_loop().time()
+        if version != self._snapshot_version:
+            return
+        previous_snapshot = self._snapshot
+        self._snapshot = snapshot
+        if previous_snapshot is None or (
+            previous_snapshot.queue_size,
+            previous_snapshot.in_flight,
+        ) != (snapshot.queue_size, snapshot.in_flight):
+            self._notify_all()
+            return
+        for job_id, job in snapshot.jobs.items():
+            if previous_snapshot.jobs.get(job_id) != job or (
+                previous_snapshot.positions.get(job_id)
+                != snapshot.positions.get(job_id)
+            ):
+                self._notify_job(job_id)
+
+    def _notify_changed(self) -> None:
+        # Changes made by this process are seen at once
+        self._snapshot = None
+        self._snapshot_version += 1
+        self._notify_all()
+
+    async def recover_jobs(self) -> int:
+        return await self._run(self._recover, self._now())
+
+    async def run_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+        loop = asyncio.get_running_loop()
+        next_sweep_time = loop.time() + interval
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                # Changes made by other processes are only seen by polling
+                await self._poll_snapshot()
+            except Exception as e:
+                logger.error(f"Polling the shared queue failed: {e}")
+            if self.running_tasks:
+                try:
+                    cancelled_job_ids = await self._run(
+                        self._get_cancelled, list(self.running_tasks)
+                    )
+                    for job_id in cancelled_job_ids:
+                        self._cancel_task(job_id)
+                except Exception as e:
+                    logger.error(f"Checking for cancelled jobs failed: {e}")
+            if loop.time() < next_sweep_time:
+                continue
+            next_sweep_time = loop.time() + interval
+            try:
+                await self._run(
+                    self._renew, list(self.processing_job_ids), self._lease_expiration()
+                )
+                recovered_count = await self.recover_jobs()
+                if recovered_count:
+                    logger.info(
+                        f"Queued {recovered_count} jobs with expired leases again"
+                    )
+                self.evicted_count += await self._run(
+                    self._prune,
+                    self._now() - datetime.timedelta(seconds=self.job_ttl),
+                )
+            except Exception as e:
+                logger.error(f"Shared queue sweep failed: {e}")
+
+    async def drain(self, timeout: float) -> None:
+        self.draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.processing_job_ids and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def close(self) -> None:
+        """Queue this process's unfinished jobs again for other workers."""
+        try:
+            await self._run(self._requeue, list(self.processing_job_ids))
+        finally:
+            await asyncio.to_thread(self._executor.shutdown, True)
+
+    def _submit(
+        self,
+        prompt: str,
+        selected_template_id: Optional[str],
+        client_id: str,
+        priority: JobPriority,
+        now: datetime.datetime,
+    ) -> Tuple[Job, str]:
+        dedup_key = make_dedup_key(prompt, selected_template_id)
+        with self.session_factory() as session:
+            active_record = session.scalars(
+                select(JobRecord)
+                .where(JobRecord.dedup_key == dedup_key)
+                .where(JobRecord.client_id == client_id)
+                .where(JobRecord.priority == priority.value)
+                .where(JobRecord.status.in_(ACTIVE_STATUSES))
+                .order_by(JobRecord.created_at.asc())
+                .limit(1)
+            ).first()
+            if active_record is not None:
+                return record_to_job(active_record), "coalesced"
+
+            if self.result_cache_ttl > 0:
+                cached_record = session.scalars(
+                    select(JobRecord)
+                    .where(JobRecord.dedup_key == dedup_key)
+                    .where(JobRecord.status == JobStatus.COMPLETED.value)
+                    .where(JobRecord.result_url.is_not(None))
+                    .where(
+                        JobRecord.completed_at
+                        > now - datetime.timedelta(seconds=self.result_cache_ttl)
+                    )
+                    .order_by(JobRecord.completed_at.desc())
+                    .limit(1)
+                ).first()
+                if cached_record is not None:
+                    return record_to_job(cached_record), "cached"
+
+            record = JobRecord(
+                job_id=str(uuid.uuid4()),
+                prompt=prompt,
+                selected_template_id=selected_template_id,
+                status=JobStatus.QUEUED.value,
+                created_at=now,
+                dedup_key=dedup_key,
+                client_id=client_id,
+                priority=priority.value,
+            )
+            record.fair_tag = self._get_finish_tag(session, client_id, priority)
+            job = record_to_job(record)
+            session.add(record)
+            session.commit()
+            return job, "queued"
+
+    def _get_finish_tag(
+        self, session: Session, client_id: str, priority: JobPriority
+    ) -> float:
+        queued = JobRecord.status == JobStatus.QUEUED.value
+        # Like FairScheduler, the tag of the most recently claimed job
+        virtual_time = session.scalar(
+            select(JobRecord.fair_tag)
+            .where(JobRecord.started_at.is_not(None))
+            .order_by(JobRecord.started_at.desc())
+            .limit(1)
+        )
+        flow_tag = session.scalar(
+            select(func.max(JobRecord.fair_tag))
+            .where(queued)
+            .where(JobRecord.client_id == client_id)
+            .where(JobRecord.priority == priority.value)
+        )
+        return get_finish_tag(
+            virtual_time or 0.0, flow_tag, self.priority_weights.get(priority, 1.0)
+        )
+
+    def _claim(
+        self, now: datetime.datetime, lease_expires_at: datetime.datetime
+    ) -> Optional[Job]:
+        oldest_queued_job_id = (
+            select(JobRecord.job_id)
+            .where(JobRecord.status == JobStatus.QUEUED.value)
+            .order_by(
+                JobRecord.fair_tag.asc(),
+                JobRecord.created_at.asc(),
+                JobRecord.job_id.asc(),
+            )
+            .limit(1)
+            .scalar_subquery()
+        )
+        with self.session_factory() as session:
+            # One statement, so concurrent claims cannot take the same job
+            record = session.scalars(
+                update(JobRecord)
+                .where(JobRecord.job_id == oldest_queued_job_id)
+                .where(JobRecord.status == JobStatus.QUEUED.value)
+                .values(
+                    status=JobStatus.PROCESSING.value,
+                    started_at=now,
+                    lease_owner=self.owner,
+                    lease_expires_at=lease_expires_at,
+                )
+                .returning(JobRecord),
+                execution_options={"synchronize_session": False},
+            ).first()
+            job = record_to_job(record) if record is not None else None
+            session.commit()
+            return job
+
+    def _update(self, job_id: str, values: Dict[str, Any]) -> None:
+        with self.session_factory() as session:
+            # A cancelled job keeps its status whatever its worker reports
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.job_id == job_id)
+                .where(JobRecord.status != JobStatus.CANCELLED.value)
+                .values(**values)
+            )
+            session.commit()
+
+    def _cancel(self, job_id: str, now: datetime.datetime) -> Optional[JobStatus]:
+        with self.session_factory() as session:
+            status = session.scalar(
+                select(JobRecord.status).where(JobRecord.job_id == job_id)
+            )
+            if status not in ACTIVE_STATUSES:
+                return None
+            # Only succeeds if no worker changed the status in between
+            result = session.execute(
+                update(JobRecord)
+                .where(JobRecord.job_id == job_id)
+                .where(JobRecord.status == status)
+                .values(
+                    status=JobStatus.CANCELLED.value,
+                    completed_at=now,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            session.commit()
+            if not getattr(result, "rowcount", 0):
+                return None
+            return JobStatus(status)
+
+    def _get_cancelled(self, job_ids: List[str]) -> List[str]:
+        with self.session_factory() as session:
+            return list(
+                session.scalars(
+                    select(JobRecord.job_id)
+                    .where(JobRecord.job_id.in_(job_ids))
+                    .where(JobRecord.status == JobStatus.CANCELLED.value)
+                )
+            )
+
+    def _get_job(self, job_id: str) -> Optional[Job]:
+        with self.session_factory() as session:
+            record = session.get(JobRecord, job_id)
+            return record_to_job(record) if record is not None else None
+
+    def _get_position(self, job: Job) -> int:
+        # Stored datetimes are naive UTC
+        created_at = job.created_at.replace(tzinfo=None)
+        with self.session_factory() as session:
+            ahead_count = session.scalar(
+                select(func.count())
+                .select_from(JobRecord)
+                .where(JobRecord.status == JobStatus.QUEUED.value)
+                .where(
+                    tuple_(JobRecord.fair_tag, JobRecord.created_at, JobRecord.job_id)
+                    < tuple_(job.fair_tag, created_at, job.job_id)
+                )
+            )
+            return (ahead_count or 0) + 1
+
+    def _take_snapshot(self, job_ids: List[str]) -> QueueSnapshot:
+        snapshot = QueueSnapshot()
+        with self.session_factory() as session:
+            counts = session.execute(
+                select(JobRecord.status, func.count())
+                .where(JobRecord.status.in_(ACTIVE_STATUSES))
+                .group_by(JobRecord.status)
+            ).all()
+            for status, count in counts:
+                if status == JobStatus.QUEUED.value:
+                    snapshot.queue_size = count
+                else:
+                    snapshot.in_flight = count
+            if not job_ids:
+                return snapshot
+
+            records = session.scalars(
+                select(JobRecord).where(JobRecord.job_id.in_(job_ids))
+            )
+            snapshot.jobs = {record.job_id: record_to_job(record) for record in records}
+            queued_job_ids = [
+                job.job_id
+                for job in snapshot.jobs.values()
+                if job.status == JobStatus.QUEUED
+            ]
+            if not queued_job_ids:
+                return snapshot
+
+            # Positions of all watched jobs in one pass over the queue
+            ranked = (
+                select(
+                    JobRecord.job_id,
+                    func.row_number()
+                    .over(
+                        order_by=(
+                            JobRecord.fair_tag.asc(),
+                            JobRecord.created_at.asc(),
+                            JobRecord.job_id.asc(),
+                        )
+                    )
+                    .label("position"),
+                )
+                .where(JobRecord.status == JobStatus.QUEUED.value)
+                .subquery()
+            )
+            positions = session.execute(
+                select(ranked.c.job_id, ranked.c.position).where(
+                    ranked.c.job_id.in_(queued_job_ids)
+                )
+            ).all()
+            snapshot.positions = {job_id: position for job_id, position in positions}
+            return snapshot
+
+    def _requeue(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        with self.session_factory() as session:
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.job_id.in_(job_ids))
+                .where(JobRecord.status == JobStatus.PROCESSING.value)
+                .where(JobRecord.lease_owner == self.owner)
+                .values(
+                    status=JobStatus.QUEUED.value,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            session.commit()
+
+    def _renew(self, job_ids: List[str], lease_expires_at: datetime.datetime) -> None:
+        if not job_ids:
+            return
+        with self.session_factory() as session:
+            session.execute(
+                update(JobRecord)
+                .where(JobRecord.job_id.in_(job_ids))
+                .where(JobRecord.lease_owner == self.owner)
+                .values(lease_expires_at=lease_expires_at)
+            )
+            session.commit()
+
+    def _recover(self, now: datetime.datetime) -> int:
+        with self.session_factory() as session:
+            result = session.execute(
+                update(JobRecord)
+                .where(JobRecord.status == JobStatus.PROCESSING.value)
+                .where(JobRecord.lease_expires_at < now)
+                .values(
+                    status=JobStatus.QUEUED.value,
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            session.commit()
+            return int(getattr(result, "rowcount", 0) or 0)
+
+    def _prune(self, before: datetime.datetime) -> int:
+        with self.session_factory() as session:
+            result = session.execute(
+                delete(JobRecord)
+                .where(JobRecord.status.in_([s.value for s in FINISHED_STATUSES]))
+                .where(JobRecord.completed_at < before)
+            )
+            session.commit()
+            return int(getattr(result, "rowcount", 0) or 0)
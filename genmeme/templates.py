@@ -0,0 +1,164 @@
+import re
+import json
+import hashlib
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+MemeTemplate = Dict[str, Any]
+
+TOKEN_RE = re.compile(r"\w+")
+# Matches in the id or name rank above matches in descriptions and examples
+FIELD_WEIGHTS = {"id": 4.0, "name": 3.0, "description": 1.0, "query_examples": 0.5}
+PREFIX_MATCH_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    # Case-insensitive, "ё" is commonly typed as "е"
+    return TOKEN_RE.findall(text.casefold().replace("ё", "е"))
+
+
+def get_field_texts(template: MemeTemplate) -> Iterator[Tuple[str, str]]:
+    yield "id", template["id"].replace("_", " ")
+    yield "name", template["name"]
+    yield "description", template.get("description", "")
+    for example in template.get("query_examples", []):
+        yield "query_examples", example.get("query", "")
+        yield "query_examples", " ".join(example.get("captions", []))
+
+
+class TemplateIndex:
+    """
+    Inverted index from tokens to template positions with field-weighted scores.
+
+    A query matches templates that contain every query token, either exactly
+    or as a prefix of an indexed token.
+    """
+
+    def __init__(self, templates: List[MemeTemplate]) -> None:
+        postings: Dict[str, Dict[int, float]] = {}
+        for position, template in enumerate(templates):
+            for field, text in get_field_texts(template):
+                weight = FIELD_WEIGHTS[field]
+                for token in tokenize(text):
+                    scores = postings.setdefault(token, {})
+                    scores[position] = max(scores.get(position, 0.0), weight)
+        self.postings = postings
+        self.tokens = sorted(postings)
+
+    def get_token_scores(self, query_token: str) -> Dict[int, float]:
+        scores = dict(self.postings.get(query_token, {}))
+        # Tokens starting with query_token follow it in sorted order
+        for index in range(bisect_left(self.tokens, query_token), len(self.tokens)):
+            token = self.tokens[index]
+            if not token.startswith(query_token):
+                break
+            if token == query_token:
+                continue
+            for position, weight in self.postings[token].items():
+                prefix_weight = weight * PREFIX_MATCH_WEIGHT
+                if prefix_weight > scores.get(position, 0.0):
+                    scores[position] = prefix_weight
+        return scores
+
+    def search(self, query: str) -> List[int]:
+        """Positions of matching templates, best matches first."""
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        total_scores: Optional[Dict[int, float]] = None
+        for query_token in dict.fromkeys(query_tokens):
+            token_scores = self.get_token_scores(query_token)
+            if total_scores is None:
+                total_scores = token_scores
+            else:
+                total_scores = {
+                    position: score + token_scores[position]
+                    for position, score in total_scores.items()
+                    if position in token_scores
+                }
+            if not total_scores:
+                return []
+        assert total_scores is not None
+        return sorted(
+            total_scores, key=lambda position: (-total_scores[position], position)
+        )
+
+
+class TemplateRegistry:
+    """
+    In-memory view of templates.json, reloaded only when the file changes.
+
+    Template dicts are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.templates: List[MemeTemplate] = []
+        self.templates_by_id: Dict[str, MemeTemplate] = {}
+        self.image_templates: List[MemeTemplate] = []
+        self.image_templates_body: bytes = b"[]"
+        self.etag: str = ""
+        self.index = TemplateIndex([])
+        self._stamp: Optional[Tuple[int, int]] = None
+
+    def refresh(self) -> "TemplateRegistry":
+        stat = self.path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            self._load(self.path.read_bytes())
+            self._stamp = stamp
+        return self
+
+    @property
+    def version(self) -> Optional[Tuple[int, int]]:
+        return self._stamp
+
+    def get(self, template_id: str) -> Optional[MemeTemplate]:
+        return self.templates_by_id.get(template_id)
+
+    def search(
+        self, query: str = "", limit: Optional[int] = None, offset: int = 0
+    ) -> Tuple[int, List[MemeTemplate]]:
+        """
+        Search image templates, returns the total number of matches and a page.
+
+        An empty query matches all image templates in file order.
+        """
+        if query.strip():
+            found = [self.image_templates[p] for p in self.index.search(query)]
+        else:
+            found = self.image_templates
+        end = None if limit is None else offset + limit
+        return len(found), found[offset:end]
+
+    def _load(self, raw: bytes) -> None:
+        templates: List[MemeTemplate] = json.loads(raw)
+        image_templates = [t for t in templates if t.get("type", "image") == "image"]
+        infos = [
+            {"id": t["id"], "name": t["name"], "description": t.get("description", "")}
+            for t in image_templates
+        ]
+        # Same compact encoding as FastAPI's JSONResponse
+        body = json.dumps(infos, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+        self.templates = templates
+        self.templates_by_id = {t["id"]: t for t in templates}
+        self.image_templates = image_templates
+        self.image_templates_body = body
+        self.index = TemplateIndex(image_templates)
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+_REGISTRIES: Dict[Path, TemplateRegistry] = {}
+
+
+def get_template_registry(templates_path: str) -> TemplateRegistry:
+    path = Path(templates_path).resolve()
+    registry = _REGISTRIES.get(path)
+    if registry is None:
+        registry = TemplateRegistry(path)
+        _REGISTRIES[path] = registry
+    return registry.refresh()
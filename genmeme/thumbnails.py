@@ -1,6 +1,29 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import List, Optional, Sequence
+
 from PIL import Image
 
+THUMBNAIL_SIZES = (200, 400, 800)
+THUMBNAIL_FORMATS = ("jpeg", "webp")
+DEFAULT_THUMBNAIL_SIZE = 400
+DEFAULT_THUMBNAIL_PROCESSES = 2
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode == "RGBA":
+        # Create a white background
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
 
 def create_thumbnail(
     image_path: Path, thumbnail_path: Path, max_size: int = 400, quality: int = 85
@@ -14,18 +37,102 @@ def create_thumbnail(
         max_size: Maximum dimension (width or height) for the thumbnail
         quality: JPEG quality (1-100)
     """
-    with Image.open(image_path) as img:
-        # Convert RGBA to RGB if needed
-        if img.mode == "RGBA":
-            # Create a white background
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-            img = background
-        elif img.mode != "RGB":
-            img = img.convert("RGB")
+    with Image.open(image_path) as original:
+        img = _to_rgb(original)
 
         # Calculate new size while maintaining aspect ratio
         img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
 
         # Save thumbnail with compression
         img.save(thumbnail_path, "JPEG", quality=quality, optimize=True)
+
+
+def get_thumbnail_name(file_name: str, variant: str) -> str:
+    return f"{Path(file_name).stem}_{variant}"
+
+
+def create_thumbnails(
+    image_path: Path,
+    thumbnail_dir: Path,
+    sizes: Sequence[int] = THUMBNAIL_SIZES,
+    formats: Sequence[str] = THUMBNAIL_FORMATS,
+    quality: int = 85,
+) -> List[str]:
+    """
+    Create thumbnails of several sizes and formats from a single decode.
+
+    Each size is downscaled from the previous, larger one.
+
+    Args:
+        image_path: Path to the original image
+        thumbnail_dir: Directory where thumbnails should be saved
+        sizes: Maximum dimensions (width or height) of the thumbnails
+        formats: Pillow format names, "jpeg" and/or "webp"
+        quality: Encoder quality (1-100)
+
+    Returns:
+        Created variants as "<size>.<extension>", e.g. "400.webp".
+        A variant is saved as get_thumbnail_name(image_path.name, variant).
+    """
+    variants = []
+    with Image.open(image_path) as original:
+        img = _to_rgb(original)
+        for size in sorted(sizes, reverse=True):
+            img = img.copy()
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for image_format in formats:
+                variant = f"{size}.{FORMAT_EXTENSIONS[image_format]}"
+                thumbnail_path = thumbnail_dir / get_thumbnail_name(
+                    image_path.name, variant
+                )
+                if image_format == "webp":
+                    img.save(thumbnail_path, "WEBP", quality=quality, method=4)
+                else:
+                    img.save(thumbnail_path, "JPEG", quality=quality, optimize=True)
+                variants.append(variant)
+    return variants
+
+
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def start_thumbnail_pool(
+    max_workers: int = DEFAULT_THUMBNAIL_PROCESSES,
+) -> ProcessPoolExecutor:
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        # Forking a process that already runs threads can copy held locks
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _PROCESS_POOL
+
+
+def shutdown_thumbnail_pool() -> None:
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=True, cancel_futures=True)
+        _PROCESS_POOL = None
+
+
+async def create_thumbnails_async(
+    image_path: Path,
+    thumbnail_dir: Path,
+    sizes: Sequence[int] = THUMBNAIL_SIZES,
+    formats: Sequence[str] = THUMBNAIL_FORMATS,
+    quality: int = 85,
+) -> List[str]:
+    """Run create_thumbnails in the thumbnail process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        start_thumbnail_pool(),
+        partial(
+            create_thumbnails,
+            image_path,
+            thumbnail_dir,
+            sizes=tuple(sizes),
+            formats=tuple(formats),
+            quality=quality,
+        ),
+    )
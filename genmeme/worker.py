@@ -0,0 +1,340 @@
+import os
+import signal
+import asyncio
+import datetime
+import logging
+import traceback
+from pathlib import Path
+from typing import List, Optional
+
+import fire  # type: ignore
+from dotenv import load_dotenv
+
+from genmeme.files import STORAGE_PATH, PROMPT_PATH, TEMPLATES_PATH
+from genmeme.gen import generate_meme, get_template_image_path
+from genmeme.llm import (
+    CIRCUIT_BREAKER,
+    IMAGE_CACHE,
+    configure_retries_from_env,
+    DEFAULT_IMAGE_CACHE_MAX_BYTES,
+    get_api_keys_from_env,
+    get_client_pool,
+    close_client_pool,
+)
+from genmeme.db import ImageRecord, IMAGE_STORE
+from genmeme.queue import (
+    QueueBackend,
+    QueueManager,
+    JobStatus,
+    Job,
+    DEFAULT_JOB_TTL,
+    DEFAULT_MAX_JOBS,
+    DEFAULT_LEASE_DURATION,
+    DEFAULT_PRIORITY_WEIGHTS,
+    DEFAULT_RESULT_CACHE_TTL,
+    SQLiteJobStore,
+)
+from genmeme.shared_queue import SharedQueue
+from genmeme.thumbnails import (
+    DEFAULT_THUMBNAIL_SIZE,
+    DEFAULT_THUMBNAIL_PROCESSES,
+    create_thumbnails_async,
+    get_thumbnail_name,
+    start_thumbnail_pool,
+    shutdown_thumbnail_pool,
+)
+from genmeme.templates import get_template_registry
+from genmeme.metrics import STAGE_DURATION, JOB_DURATION, JOBS_FINISHED
+from genmeme.admission import SERVICE_RATE
+
+logger = logging.getLogger("uvicorn")
+
+# Twice the generation slots, so that every slot stays in use while other
+# workers make thumbnails and save their jobs
+DEFAULT_NUM_WORKERS = 8
+DEFAULT_MAX_CONCURRENT_GENERATIONS = 4
+DEFAULT_SHUTDOWN_DRAIN_SECONDS = 30.0
+
+
+def create_queue_from_env() -> QueueBackend:
+    job_ttl = float(os.getenv("JOB_TTL_SECONDS", DEFAULT_JOB_TTL))
+    result_cache_ttl = float(
+        os.getenv("RESULT_CACHE_SECONDS", DEFAULT_RESULT_CACHE_TTL)
+    )
+    lease_duration = float(os.getenv("JOB_LEASE_SECONDS", DEFAULT_LEASE_DURATION))
+    priority_weights = {
+        priority: float(os.getenv(f"{priority.name}_PRIORITY_WEIGHT", default_weight))
+        for priority, default_weight in DEFAULT_PRIORITY_WEIGHTS.items()
+    }
+
+    backend = os.getenv("QUEUE_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        return SharedQueue(
+            job_ttl=job_ttl,
+            result_cache_ttl=result_cache_ttl,
+            lease_duration=lease_duration,
+            priority_weights=priority_weights,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown QUEUE_BACKEND: {backend}")
+
+    queue = QueueManager(
+        job_ttl=job_ttl,
+        max_jobs=int(os.getenv("MAX_JOBS", DEFAULT_MAX_JOBS)),
+        result_cache_ttl=result_cache_ttl,
+        priority_weights=priority_weights,
+    )
+    if os.getenv("PERSISTENT_QUEUE", "false").lower() == "true":
+        queue.store = SQLiteJobStore(lease_duration=lease_duration)
+    return queue
+
+
+def setup_image_cache() -> None:
+    IMAGE_CACHE.max_bytes = int(
+        os.getenv("IMAGE_CACHE_MAX_BYTES", DEFAULT_IMAGE_CACHE_MAX_BYTES)
+    )
+    if os.getenv("WARM_UP_IMAGE_CACHE", "false").lower() != "true":
+        return
+
+    templates_path = str(TEMPLATES_PATH)
+    env_templates_path = os.getenv("TEMPLATES_PATH")
+    if env_templates_path:
+        templates_path = env_templates_path
+
+    registry = get_template_registry(templates_path)
+    IMAGE_CACHE.warm_up(
+        get_template_image_path(t["id"]) for t in registry.image_templates
+    )
+    logger.info(
+        f"Image cache warmed up: {len(registry.image_templates)} templates, {IMAGE_CACHE.current_bytes} bytes"
+    )
+
+
+def setup_generation() -> None:
+    setup_image_cache()
+    configure_retries_from_env()
+    if get_api_keys_from_env():
+        pool = get_client_pool()
+        logger.info(f"OpenRouter client pool ready with {len(pool.api_keys)} keys")
+    start_thumbnail_pool(
+        int(os.getenv("THUMBNAIL_PROCESSES", DEFAULT_THUMBNAIL_PROCESSES))
+    )
+    IMAGE_STORE.start()
+
+
+async def shutdown_generation() -> None:
+    await close_client_pool()
+    shutdown_thumbnail_pool()
+    IMAGE_STORE.stop()
+
+
+def observe_job_finished(job: Job, status: JobStatus) -> None:
+    SERVICE_RATE.record()
+    JOBS_FINISHED.inc(status=status.value)
+    JOB_DURATION.observe(
+        (datetime.datetime.now(datetime.UTC) - job.created_at).total_seconds(),
+        status=status.value,
+    )
+
+
+class GenerationSlot:
+    """A permit of the upstream semaphore, released at most once."""
+
+    def __init__(self, semaphore: asyncio.Semaphore) -> None:
+        self.semaphore = semaphore
+        self.held = False
+
+    async def acquire(self) -> None:
+        await self.semaphore.acquire()
+        self.held = True
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+async def process_queue_worker(
+    queue: QueueBackend, upstream_semaphore: asyncio.Semaphore
+) -> None:
+    """
+    Dequeue and run jobs until cancelled.
+
+    A generation slot is taken before dequeuing, so a job is only claimed,
+    and marked processing, once its upstream call can start. The slot is
+    freed when the call returns, and the worker then makes thumbnails and
+    saves the job while another worker uses the slot.
+    """
+    while True:
+        slot = GenerationSlot(upstream_semaphore)
+        await slot.acquire()
+        try:
+            # Leave jobs queued while upstream is known to be failing
+            await CIRCUIT_BREAKER.wait_until_closed()
+            job = await queue.dequeue()
+            # A job runs in its own task, so cancelling it does not stop the worker
+            task = asyncio.create_task(run_job(queue, job, slot))
+            queue.register_task(job.job_id, task)
+            try:
+                await task
+            except asyncio.CancelledError:
+                current_task = asyncio.current_task()
+                if current_task is not None and current_task.cancelling():
+                    raise
+                logger.info(f'CANCELLED job_id="{job.job_id}"')
+                await queue.update_job_status(job.job_id, JobStatus.CANCELLED)
+                observe_job_finished(job, JobStatus.CANCELLED)
+            finally:
+                queue.unregister_task(job.job_id)
+        finally:
+            slot.release()
+
+
+async def run_job(queue: QueueBackend, job: Job, slot: GenerationSlot) -> None:
+    try:
+        await queue.update_job_status(job.job_id, JobStatus.PROCESSING)
+        STAGE_DURATION.observe(
+            (datetime.datetime.now(datetime.UTC) - job.created_at).total_seconds(),
+            stage="queue_wait",
+        )
+
+        generate_prompt_path = str(PROMPT_PATH)
+        env_prompt_path = os.getenv("PROMPT_PATH")
+        if env_prompt_path:
+            generate_prompt_path = env_prompt_path
+
+        templates_path = str(TEMPLATES_PATH)
+        env_templates_path = os.getenv("TEMPLATES_PATH")
+        if env_templates_path:
+            templates_path = env_templates_path
+
+        try:
+            response = await generate_meme(
+                job.prompt,
+                generate_prompt_path=generate_prompt_path,
+                templates_path=templates_path,
+                selected_template_id=job.selected_template_id,
+            )
+        finally:
+            slot.release()
+
+        public_url = f"output/{response.file_name}"
+
+        # Generate thumbnails
+        image_path = Path(STORAGE_PATH) / response.file_name
+        thumbnail_dir = Path(STORAGE_PATH) / "thumbnails"
+        thumbnail_dir.mkdir(exist_ok=True)
+        thumbnail_name = get_thumbnail_name(
+            response.file_name, f"{DEFAULT_THUMBNAIL_SIZE}.jpg"
+        )
+        thumbnail_url = f"output/thumbnails/{thumbnail_name}"
+        thumbnail_variants: Optional[str] = None
+
+        try:
+            with STAGE_DURATION.time(stage="thumbnails"):
+                variants = await create_thumbnails_async(image_path, thumbnail_dir)
+            thumbnail_variants = ",".join(variants)
+        except Exception as e:
+            logger.error(f"Failed to create thumbnails: {e}")
+            thumbnail_url = public_url
+
+        logger.info(
+            f'OUTPUT job_id="{job.job_id}" file="{response.file_name}" templates="{",".join(response.template_ids)}"'
+        )
+
+        db_record = ImageRecord(
+            result_id=response.file_name.split(".")[0],
+            public_url=public_url,
+            thumbnail_url=thumbnail_url,
+            query=job.prompt,
+            created_at=datetime.datetime.now(datetime.UTC),
+            template_ids=",".join(response.template_ids),
+            thumbnail_variants=thumbnail_variants,
+            job_id=job.job_id,
+        )
+        with STAGE_DURATION.time(stage="db_commit"):
+            await IMAGE_STORE.add(db_record)
+
+        await queue.update_job_status(
+            job.job_id,
+            JobStatus.COMPLETED,
+            result_url=public_url,
+        )
+        observe_job_finished(job, JobStatus.COMPLETED)
+
+    except Exception as e:
+        error_msg = str(e)
+        traceback.print_exc()
+        await queue.update_job_status(job.job_id, JobStatus.FAILED, error=error_msg)
+        observe_job_finished(job, JobStatus.FAILED)
+
+
+def start_workers(
+    queue: QueueBackend, num_workers: int, max_concurrent_generations: int
+) -> List["asyncio.Task[None]"]:
+    upstream_semaphore = asyncio.Semaphore(max(1, max_concurrent_generations))
+    return [
+        asyncio.create_task(process_queue_worker(queue, upstream_semaphore))
+        for _ in range(num_workers)
+    ]
+
+
+async def run_standalone_workers(
+    num_workers: int, max_concurrent_generations: int
+) -> None:
+    queue = create_queue_from_env()
+    if not isinstance(queue, SharedQueue):
+        raise ValueError("A standalone worker needs QUEUE_BACKEND=sqlite")
+
+    setup_generation()
+    recovered_count = await queue.recover_jobs()
+    logger.info(f"Recovered {recovered_count} jobs with expired leases")
+    sweeper_task = asyncio.create_task(queue.run_sweeper())
+    tasks = start_workers(queue, num_workers, max_concurrent_generations)
+    logger.info(
+        f"Started {len(tasks)} queue workers, max {max_concurrent_generations} concurrent generations"
+    )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+    logger.info("Shutting down, waiting for in-flight jobs")
+    await queue.drain(
+        float(os.getenv("SHUTDOWN_DRAIN_SECONDS", DEFAULT_SHUTDOWN_DRAIN_SECONDS))
+    )
+    sweeper_task.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(sweeper_task, *tasks, return_exceptions=True)
+    await queue.close()
+    await shutdown_generation()
+
+
+def main(
+    num_workers: Optional[int] = None,
+    max_concurrent_generations: Optional[int] = None,
+) -> None:
+    """
+    Run queue workers without the API, against the shared SQLite queue.
+
+    Args:
+        num_workers: Number of workers, NUM_WORKERS by default
+        max_concurrent_generations: Limit of simultaneous OpenRouter calls,
+            MAX_CONCURRENT_GENERATIONS by default
+    """
+    logging.basicConfig(level=logging.INFO)
+    if num_workers is None:
+        num_workers = int(os.getenv("NUM_WORKERS", DEFAULT_NUM_WORKERS))
+    if max_concurrent_generations is None:
+        max_concurrent_generations = int(
+            os.getenv("MAX_CONCURRENT_GENERATIONS", DEFAULT_MAX_CONCURRENT_GENERATIONS)
+        )
+    asyncio.run(run_standalone_workers(max(1, num_workers), max_concurrent_generations))
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    fire.Fire(main)
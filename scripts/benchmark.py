@@ -0,0 +1,414 @@
+"""
+End-to-end load benchmark against a local fake OpenRouter server.
+
+Starts a stand-in for the /chat/completions image endpoint, runs the meme
+server in a subprocess pointed at it and drives /api/v1/predict plus job
+polling with N concurrent clients. Runs offline:
+
+    python -m scripts.benchmark --clients 8 --jobs 200 --latency 0.5
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import base64
+import random
+import shutil
+import socket
+import asyncio
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import fire  # type: ignore
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from genmeme.files import ROOT_PATH, STORAGE_PATH, TEMPLATES_PATH
+from genmeme.thumbnails import get_thumbnail_name
+
+FINISHED_STATUSES = ("completed", "failed")
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def make_image_data_url(image_size: int, image_format: str = "png") -> str:
+    # Noise does not compress, so the payload is close to a real generated image
+    img = Image.effect_noise((image_size, image_size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, image_format.upper())
+    data = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:image/{image_format};base64,{data}"
+
+
+def create_fake_upstream(
+    latency: float, latency_jitter: float, error_rate: float, image_url: str
+) -> FastAPI:
+    app = FastAPI()
+    app.state.requests_count = 0
+    app.state.errors_count = 0
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request) -> JSONResponse:
+        body = await request.json()
+        app.state.requests_count += 1
+        jitter = random.uniform(-latency_jitter, latency_jitter)
+        await asyncio.sleep(max(0.0, latency * (1 + jitter)))
+        if random.random() < error_rate:
+            app.state.errors_count += 1
+            return JSONResponse(
+                status_code=503,
+                content={"error": {"message": "Fake upstream error", "code": 503}},
+            )
+        return JSONResponse(
+            {
+                "id": f"gen-{app.state.requests_count}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": "",
+                            "images": [
+                                {"type": "image_url", "image_url": {"url": image_url}}
+                            ],
+                        },
+                    }
+                ],
+            }
+        )
+
+    return app
+
+
+def create_template_images(images_path: Path) -> None:
+    with open(TEMPLATES_PATH) as f:
+        templates = json.load(f)
+    img = Image.new("RGB", (512, 512), (128, 128, 128))
+    for template in templates:
+        img.save(images_path / f"{template['id']}.jpg", "JPEG")
+
+
+def get_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(
+        values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))], 3
+    )
+
+
+def parse_histogram(
+    metrics_text: str, name: str
+) -> Tuple[List[Tuple[float, float]], float, float]:
+    buckets = []
+    total = 0.0
+    count = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(f'{name}_bucket{{le="'):
+            bound = line.split('"')[1]
+            buckets.append(
+                (math.inf if bound == "+Inf" else float(bound), float(line.split()[-1]))
+            )
+        elif line.startswith(f"{name}_sum"):
+            total = float(line.split()[-1])
+        elif line.startswith(f"{name}_count"):
+            count = float(line.split()[-1])
+    return buckets, total, count
+
+
+def get_histogram_quantile(
+    buckets: List[Tuple[float, float]], q: float
+) -> Optional[float]:
+    # Upper bound of the bucket holding the quantile, None if it is +Inf
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            return None if math.isinf(bound) else bound
+    return None
+
+
+async def wait_until_ready(
+    client: httpx.AsyncClient, process: subprocess.Popen[bytes], timeout: float
+) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError("Server did not start in time")
+
+
+async def run_client(
+    client: httpx.AsyncClient,
+    jobs: int,
+    next_job: List[int],
+    poll_interval: float,
+    job_timeout: float,
+    results: List[Dict[str, Any]],
+) -> None:
+    while next_job[0] < jobs:
+        job_index = next_job[0]
+        next_job[0] += 1
+        start_time = time.perf_counter()
+        # Unique prompts, so requests are not coalesced
+        response = await client.post(
+            "/api/v1/predict", json={"prompt": f"Benchmark query number {job_index}"}
+        )
+        if response.status_code != 200:
+            results.append({"status": f"http_{response.status_code}", "latency": None})
+            continue
+        job_id = response.json()["job_id"]
+
+        status = "timeout"
+        job: Dict[str, Any] = {}
+        while time.perf_counter() - start_time < job_timeout:
+            await asyncio.sleep(poll_interval)
+            job = (await client.get(f"/api/v1/job/{job_id}")).json()
+            if job["status"] in FINISHED_STATUSES:
+                status = job["status"]
+                break
+        results.append(
+            {
+                "status": status,
+                "latency": time.perf_counter() - start_time,
+                "result_url": job.get("result_url"),
+            }
+        )
+
+
+async def sample_rss(pid: int, samples: List[int], interval: float = 0.2) -> None:
+    while True:
+        rss = get_rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(interval)
+
+
+def remove_outputs(results: List[Dict[str, Any]]) -> None:
+    thumbnail_dir = STORAGE_PATH / "thumbnails"
+    for result in results:
+        if not result.get("result_url"):
+            continue
+        file_name = Path(result["result_url"]).name
+        (STORAGE_PATH / file_name).unlink(missing_ok=True)
+        for thumbnail_path in thumbnail_dir.glob(get_thumbnail_name(file_name, "*")):
+            thumbnail_path.unlink(missing_ok=True)
+
+
+async def run_benchmark(
+    clients: int,
+    jobs: int,
+    latency: float,
+    latency_jitter: float,
+    error_rate: float,
+    image_size: int,
+    num_workers: int,
+    max_concurrent_generations: int,
+    poll_interval: float,
+    job_timeout: float,
+    keep_outputs: bool,
+) -> Dict[str, Any]:
+    work_dir = Path(tempfile.mkdtemp(prefix="genmeme_bench_"))
+    images_path = work_dir / "images"
+    images_path.mkdir()
+    create_template_images(images_path)
+    STORAGE_PATH.mkdir(exist_ok=True)
+
+    upstream_app = create_fake_upstream(
+        latency, latency_jitter, error_rate, make_image_data_url(image_size)
+    )
+    upstream_port = get_free_port()
+    upstream = uvicorn.Server(
+        uvicorn.Config(
+            upstream_app, host="127.0.0.1", port=upstream_port, log_level="warning"
+        )
+    )
+    upstream_task = asyncio.create_task(upstream.serve())
+
+    server_port = get_free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": str(ROOT_PATH),
+            "ENABLE_GENERATION": "true",
+            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{upstream_port}/api/v1",
+            "OPENROUTER_API_KEY": "benchmark",
+            "OPENROUTER_API_KEYS": "",
+            "IMAGES_PATH": str(images_path),
+            "NUM_WORKERS": str(num_workers),
+            "MAX_CONCURRENT_GENERATIONS": str(max_concurrent_generations),
+            "LLM_RETRY_BASE_DELAY": env.get("LLM_RETRY_BASE_DELAY", "0.1"),
+        }
+    )
+    log_file = open(work_dir / "server.log", "wb")
+    # Own working directory, so the server uses a fresh images.db
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "genmeme.server",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(server_port),
+        ],
+        cwd=work_dir,
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+
+    results: List[Dict[str, Any]] = []
+    rss_samples: List[int] = []
+    try:
+        limits = httpx.Limits(max_connections=clients + 4)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{server_port}", limits=limits, timeout=60.0
+        ) as client:
+            await wait_until_ready(client, process, timeout=60.0)
+            rss_task = asyncio.create_task(sample_rss(process.pid, rss_samples))
+            start_time = time.perf_counter()
+            next_job = [0]
+            await asyncio.gather(
+                *[
+                    run_client(
+                        client, jobs, next_job, poll_interval, job_timeout, results
+                    )
+                    for _ in range(clients)
+                ]
+            )
+            elapsed = time.perf_counter() - start_time
+            rss_task.cancel()
+            metrics_text = (await client.get("/metrics")).text
+    except BaseException:
+        log_file.flush()
+        print((work_dir / "server.log").read_text()[-4000:], file=sys.stderr)
+        raise
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log_file.close()
+        upstream.should_exit = True
+        await upstream_task
+        if not keep_outputs:
+            remove_outputs(results)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = [r["latency"] for r in results if r["status"] == "completed"]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    lag_buckets, lag_sum, lag_count = parse_histogram(
+        metrics_text, "genmeme_event_loop_lag_seconds"
+    )
+    return {
+        "clients": clients,
+        "jobs": jobs,
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 3),
+        "jobs_per_second": round(len(latencies) / elapsed, 3),
+        "latency_p50": get_percentile(latencies, 0.5),
+        "latency_p95": get_percentile(latencies, 0.95),
+        "latency_p99": get_percentile(latencies, 0.99),
+        "event_loop_lag_mean": round(lag_sum / lag_count, 4) if lag_count else None,
+        "event_loop_lag_p99_bound": get_histogram_quantile(lag_buckets, 0.99),
+        "rss_peak_bytes": max(rss_samples) if rss_samples else None,
+        "rss_last_bytes": rss_samples[-1] if rss_samples else None,
+        "upstream_requests": upstream_app.state.requests_count,
+        "upstream_errors": upstream_app.state.errors_count,
+    }
+
+
+def main(
+    clients: int = 8,
+    jobs: int = 100,
+    latency: float = 0.5,
+    latency_jitter: float = 0.2,
+    error_rate: float = 0.0,
+    image_size: int = 1024,
+    num_workers: int = 4,
+    max_concurrent_generations: int = 4,
+    poll_interval: float = 0.1,
+    job_timeout: float = 300.0,
+    output_path: Optional[str] = None,
+    keep_outputs: bool = False,
+) -> None:
+    """
+    Run the benchmark and print the report as JSON.
+
+    Args:
+        clients: Number of concurrent simulated clients
+        jobs: Total number of jobs to submit
+        latency: Mean fake upstream latency in seconds
+        latency_jitter: Relative uniform jitter of the latency
+        error_rate: Share of upstream calls answered with 503
+        image_size: Side of the generated image in pixels
+        num_workers: NUM_WORKERS of the server
+        max_concurrent_generations: MAX_CONCURRENT_GENERATIONS of the server
+        poll_interval: Job status polling interval in seconds
+        job_timeout: Time after which a job is counted as timed out
+        output_path: Optional path to also write the report to
+        keep_outputs: Keep generated images in output/
+    """
+    report = asyncio.run(
+        run_benchmark(
+            clients=clients,
+            jobs=jobs,
+            latency=latency,
+            latency_jitter=latency_jitter,
+            error_rate=error_rate,
+            image_size=image_size,
+            num_workers=num_workers,
+            max_concurrent_generations=max_concurrent_generations,
+            poll_interval=poll_interval,
+            job_timeout=job_timeout,
+            keep_outputs=keep_outputs,
+        )
+    )
+    report_text = json.dumps(report, indent=2)
+    print(report_text)
+    if output_path:
+        with open(output_path, "w") as f:
+            f.write(report_text + "\n")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,32 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from genmeme.files import STORAGE_PATH
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    # genmeme.db opens ./images.db on import, keep the tests off the checkout's one
+    os.chdir(tempfile.mkdtemp(prefix="genmeme-tests-"))
+    # genmeme.server serves STORAGE_PATH, which download.sh creates in a checkout
+    STORAGE_PATH.mkdir(exist_ok=True)
+
+
+def make_session_factory(path: Path) -> Callable[[], Session]:
+    """A separate engine on the database file, like another process would use."""
+    from genmeme.db import create_schema, set_sqlite_pragmas
+
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    create_schema(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> Path:
+    return tmp_path / "test.db"
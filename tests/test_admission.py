@@ -0,0 +1,79 @@
+import math
+from collections import OrderedDict
+
+import pytest
+from fastapi import HTTPException
+
+from genmeme.admission import RATE_LIMITER, RateLimiter, TokenBucket, check_admission
+
+
+def test_bucket_starts_full_and_empties() -> None:
+    bucket = TokenBucket(rate=1.0, burst=3.0, now=0.0)
+    assert [bucket.take(1.0, now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(1.0, now=0.0) == 1.0
+
+
+def test_bucket_refills_at_rate() -> None:
+    bucket = TokenBucket(rate=0.5, burst=2.0, now=0.0)
+    bucket.take(2.0, now=0.0)
+
+    # Half a token after one second, one token takes another second
+    assert bucket.take(1.0, now=1.0) == 1.0
+    assert bucket.take(1.0, now=2.0) == 0.0
+    assert bucket.take(1.0, now=2.0) == 2.0
+
+
+def test_bucket_refills_up_to_burst() -> None:
+    bucket = TokenBucket(rate=1.0, burst=2.0, now=0.0)
+    bucket.take(2.0, now=0.0)
+
+    assert bucket.take(2.0, now=100.0) == 0.0
+    assert bucket.take(1.0, now=100.0) == 1.0
+
+
+def test_bucket_never_fits_more_than_burst() -> None:
+    bucket = TokenBucket(rate=1.0, burst=2.0, now=0.0)
+    assert bucket.take(3.0, now=0.0) == math.inf
+    # A rejected take uses no tokens
+    assert bucket.take(2.0, now=0.0) == 0.0
+
+
+def test_rate_limiter_tracks_clients_separately(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr("genmeme.admission.time.monotonic", lambda: 0.0)
+    limiter = RateLimiter(rate=1.0, burst=1.0, max_clients=2)
+
+    assert limiter.take("a") == 0.0
+    assert limiter.take("a") == 1.0
+    assert limiter.take("b") == 0.0
+    # Tracking c forgets a, the least recently seen client
+    assert limiter.take("c") == 0.0
+    assert list(limiter.buckets) == ["b", "c"]
+    assert limiter.take("a") == 0.0
+
+
+def test_disabled_rate_limiter_allows_everything() -> None:
+    limiter = RateLimiter(rate=0.0, burst=1.0)
+    assert [limiter.take("a") for _ in range(5)] == [0.0] * 5
+    assert not limiter.buckets
+
+
+def test_full_queue_is_rejected_without_using_tokens(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("MAX_QUEUE_DEPTH", "2")
+    monkeypatch.setattr(RATE_LIMITER, "rate", 1.0)
+    monkeypatch.setattr(RATE_LIMITER, "burst", 1.0)
+    monkeypatch.setattr(RATE_LIMITER, "buckets", OrderedDict())
+
+    with pytest.raises(HTTPException) as exc_info:
+        check_admission("ip:10.0.0.1", queue_size=2)
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers is not None
+    assert "Retry-After" in exc_info.value.headers
+
+    check_admission("ip:10.0.0.1", queue_size=1)
+    with pytest.raises(HTTPException) as exc_info:
+        check_admission("ip:10.0.0.1", queue_size=0)
+    assert exc_info.value.status_code == 429
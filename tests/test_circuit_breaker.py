@@ -0,0 +1,124 @@
+import asyncio
+from typing import List
+
+import httpx
+import openai
+import pytest
+
+from genmeme.llm import (
+    CircuitBreaker,
+    NoImageGeneratedError,
+    RetryPolicy,
+    call_with_retries,
+)
+
+NO_DELAY = RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    fake_clock = FakeClock()
+    monkeypatch.setattr("genmeme.llm.time.monotonic", fake_clock)
+    return fake_clock
+
+
+def make_status_error(status_code: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError("upstream error", response=response, body=None)
+
+
+def test_opens_after_consecutive_failures(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow_request()
+    assert breaker.get_open_time_left() == 30.0
+
+
+def test_half_open_trial_success_closes(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+
+    clock.now += 30.0
+    assert breaker.allow_request()
+    # Only one trial call at a time
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_half_open_trial_failure_opens_again(clock: FakeClock) -> None:
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+    for _ in range(5):
+        breaker.record_failure()
+
+    clock.now += 30.0
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.trial_in_progress
+    assert breaker.get_open_time_left() == 30.0
+    assert not breaker.allow_request()
+
+
+@pytest.mark.asyncio
+async def test_upstream_failures_open_the_circuit() -> None:
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+
+    async def call() -> None:
+        raise make_status_error(503)
+
+    with pytest.raises(openai.APIStatusError):
+        await call_with_retries(call, NO_DELAY, breaker)
+    assert breaker.is_open
+
+
+@pytest.mark.asyncio
+async def test_missing_images_do_not_open_the_circuit() -> None:
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+
+    async def call() -> None:
+        raise NoImageGeneratedError("No image in response")
+
+    for _ in range(2):
+        with pytest.raises(NoImageGeneratedError):
+            await call_with_retries(call, NO_DELAY, breaker)
+    assert not breaker.is_open
+
+
+@pytest.mark.asyncio
+async def test_waiting_calls_go_through_after_trial_success() -> None:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    calls: List[int] = []
+
+    async def call() -> int:
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(0.01)
+        return index
+
+    results = await asyncio.gather(
+        *(call_with_retries(call, NO_DELAY, breaker) for _ in range(3))
+    )
+    assert sorted(results) == [0, 1, 2]
+    assert not breaker.is_open
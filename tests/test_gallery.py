@@ -0,0 +1,133 @@
+import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from genmeme import server
+from genmeme.db import ImageRecord, ImageStore
+from genmeme.server import (
+    APP,
+    GalleryCache,
+    make_gallery_cursor,
+    parse_gallery_cursor,
+    query_gallery_page,
+)
+
+from conftest import make_session_factory
+
+START_TIME = datetime.datetime(2025, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def session_factory(
+    db_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Callable[[], Session]]:
+    session_factory = make_session_factory(db_path)
+    image_store = ImageStore(session_factory)
+    monkeypatch.setattr(server, "IMAGE_STORE", image_store)
+    monkeypatch.setattr(server, "GALLERY_CACHE", GalleryCache())
+    yield session_factory
+    image_store.stop()
+
+
+def add_images(
+    session_factory: Callable[[], Session], result_ids: List[str], minutes: List[int]
+) -> None:
+    with session_factory() as session:
+        for result_id, minute in zip(result_ids, minutes):
+            session.add(
+                ImageRecord(
+                    result_id=result_id,
+                    public_url=f"/output/{result_id}.png",
+                    created_at=START_TIME + datetime.timedelta(minutes=minute),
+                )
+            )
+        session.commit()
+
+
+def get_page_ids(
+    session_factory: Callable[[], Session], after: Optional[str], page_size: int = 2
+) -> Tuple[List[str], Optional[str]]:
+    cursor = parse_gallery_cursor(after) if after else None
+    with session_factory() as session:
+        response = query_gallery_page(1, page_size, cursor, session)
+    return [meme.result_id for meme in response.memes], response.next_cursor
+
+
+def test_cursor_walks_every_image_once_in_order(
+    session_factory: Callable[[], Session],
+) -> None:
+    # b and c share a timestamp, result_id breaks the tie
+    add_images(session_factory, ["e", "c", "b", "a", "d"], [4, 2, 2, 1, 3])
+
+    result_ids: List[str] = []
+    after = None
+    for _ in range(3):
+        page_ids, after = get_page_ids(session_factory, after)
+        result_ids += page_ids
+    assert result_ids == ["a", "b", "c", "d", "e"]
+    assert after is None
+
+
+def test_cursor_pages_do_not_shift_on_insert(
+    session_factory: Callable[[], Session],
+) -> None:
+    add_images(session_factory, ["a", "b", "c", "d"], [1, 2, 3, 4])
+    page_ids, after = get_page_ids(session_factory, None)
+    assert page_ids == ["a", "b"]
+
+    # Unlike page numbers, an image inserted before the cursor changes nothing
+    add_images(session_factory, ["aa"], [0])
+    assert get_page_ids(session_factory, after) == (["c", "d"], make_cursor("d", 4))
+
+
+def make_cursor(result_id: str, minute: int) -> Optional[str]:
+    return make_gallery_cursor(
+        ImageRecord(
+            result_id=result_id,
+            created_at=START_TIME + datetime.timedelta(minutes=minute),
+        )
+    )
+
+
+def test_cursor_round_trips() -> None:
+    cursor = make_cursor("a,b", 5)
+    assert cursor is not None
+    assert parse_gallery_cursor(cursor) == (
+        START_TIME + datetime.timedelta(minutes=5),
+        "a,b",
+    )
+    assert make_gallery_cursor(ImageRecord(result_id="a")) is None
+
+
+def test_invalid_cursor_is_rejected() -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        parse_gallery_cursor("not a cursor")
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_gallery_endpoint_follows_next_cursor(
+    session_factory: Callable[[], Session],
+) -> None:
+    add_images(session_factory, ["a", "b", "c"], [1, 2, 3])
+    transport = httpx.ASGITransport(app=APP)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        first_page = (await client.get("/api/v1/gallery?page_size=2")).json()
+        second_page = (
+            await client.get(
+                "/api/v1/gallery",
+                params={"page_size": 2, "after": first_page["next_cursor"]},
+            )
+        ).json()
+        invalid_cursor = await client.get("/api/v1/gallery?after=invalid")
+
+    assert [meme["result_id"] for meme in first_page["memes"]] == ["a", "b"]
+    assert first_page["total"] == 3
+    assert [meme["result_id"] for meme in second_page["memes"]] == ["c"]
+    assert second_page["next_cursor"] is None
+    assert invalid_cursor.status_code == 400
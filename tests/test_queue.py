@@ -0,0 +1,34 @@
+import pytest
+
+from genmeme.queue import JobStatus, QueueManager
+
+
+@pytest.mark.asyncio
+async def test_oldest_finished_jobs_are_evicted_beyond_max_jobs() -> None:
+    queue = QueueManager(max_jobs=2)
+    jobs = [(await queue.submit(f"prompt {i}"))[0] for i in range(2)]
+    for job in jobs:
+        await queue.update_job_status(job.job_id, JobStatus.COMPLETED)
+
+    active_job, _ = await queue.submit("active")
+    assert queue.evicted_count == 1
+    assert await queue.get_job(jobs[0].job_id) is None
+    assert await queue.get_job(jobs[1].job_id) is jobs[1]
+
+    # Queued and processing jobs are never evicted
+    await queue.submit("queued")
+    await queue.submit("another")
+    assert queue.evicted_count == 2
+    assert await queue.get_job(active_job.job_id) is active_job
+    assert len(queue.jobs) == 3
+
+
+@pytest.mark.asyncio
+async def test_expired_finished_jobs_are_evicted() -> None:
+    queue = QueueManager(job_ttl=0.0)
+    job, _ = await queue.submit("prompt")
+    await queue.update_job_status(job.job_id, JobStatus.FAILED, error="failed")
+
+    assert queue.evict_finished_jobs() == 1
+    assert queue.evicted_count == 1
+    assert not queue.jobs
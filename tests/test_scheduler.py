@@ -0,0 +1,119 @@
+from pathlib import Path
+from typing import AsyncIterator, List
+
+import pytest
+import pytest_asyncio
+
+from genmeme.queue import Job, JobPriority, QueueBackend, QueueManager
+from genmeme.scheduler import FairScheduler
+from genmeme.shared_queue import SharedQueue
+
+from conftest import make_session_factory
+
+
+def pop_all(scheduler: FairScheduler[str]) -> List[str]:
+    items = []
+    while (item := scheduler.pop()) is not None:
+        items.append(item)
+    return items
+
+
+def test_quiet_flow_is_served_after_one_item_of_each_busy_flow() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    keys = {item: scheduler.push(item, "a") for item in ("a1", "a2", "a3")}
+    keys["b1"] = scheduler.push("b1", "b")
+
+    positions = {item: scheduler.get_position(key) for item, key in keys.items()}
+    assert positions == {"a1": 1, "b1": 2, "a2": 3, "a3": 4}
+    assert pop_all(scheduler) == ["a1", "b1", "a2", "a3"]
+    assert scheduler.get_position(keys["a1"]) == 0
+
+
+def test_weights_share_the_queue() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    for i in range(4):
+        scheduler.push(f"batch{i}", "batch", weight=1.0)
+        scheduler.push(f"interactive{i}", "interactive", weight=4.0)
+
+    assert pop_all(scheduler)[:5] == [
+        "interactive0",
+        "interactive1",
+        "interactive2",
+        "batch0",
+        "interactive3",
+    ]
+
+
+def test_idle_flow_does_not_build_up_credit() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    for i in range(6):
+        scheduler.push(f"a{i}", "a")
+    assert [scheduler.pop() for _ in range(4)] == ["a0", "a1", "a2", "a3"]
+
+    # b was idle while a was served, it is put after one more item of a
+    scheduler.push("b0", "b")
+    assert pop_all(scheduler) == ["a4", "b0", "a5"]
+
+
+def test_removed_item_gives_up_its_position() -> None:
+    scheduler: FairScheduler[str] = FairScheduler()
+    first = scheduler.push("a1", "a")
+    second = scheduler.push("b1", "b")
+
+    assert scheduler.remove(first)
+    assert not scheduler.remove(first)
+    assert scheduler.get_position(second) == 1
+    assert pop_all(scheduler) == ["b1"]
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite"])
+async def queue(
+    request: pytest.FixtureRequest, db_path: Path
+) -> AsyncIterator[QueueBackend]:
+    backend: QueueBackend
+    if request.param == "memory":
+        backend = QueueManager()
+    else:
+        backend = SharedQueue(session_factory=make_session_factory(db_path))
+    yield backend
+    await backend.close()
+
+
+async def submit(queue: QueueBackend, prompt: str, client_id: str) -> Job:
+    job, _ = await queue.submit(prompt, client_id=client_id)
+    return job
+
+
+@pytest.mark.asyncio
+async def test_backends_order_clients_fairly(queue: QueueBackend) -> None:
+    jobs = {
+        "a1": await submit(queue, "a1", "a"),
+        "a2": await submit(queue, "a2", "a"),
+        "a3": await submit(queue, "a3", "a"),
+        "b1": await submit(queue, "b1", "b"),
+    }
+    positions = {name: await queue.get_position(job) for name, job in jobs.items()}
+    assert positions == {"a1": 1, "b1": 2, "a2": 3, "a3": 4}
+
+    assert (await queue.dequeue()).prompt == "a1"
+    jobs["c1"] = await submit(queue, "c1", "c")
+    positions = {}
+    for name, job in jobs.items():
+        current_job = await queue.get_job(job.job_id)
+        assert current_job is not None
+        positions[name] = await queue.get_position(current_job)
+    assert positions == {"a1": 0, "b1": 1, "a2": 2, "c1": 3, "a3": 4}
+
+    prompts = [(await queue.dequeue()).prompt for _ in range(4)]
+    assert prompts == ["b1", "a2", "c1", "a3"]
+
+
+@pytest.mark.asyncio
+async def test_backends_favour_interactive_jobs(queue: QueueBackend) -> None:
+    for i in range(2):
+        await queue.submit(f"batch{i}", client_id="a", priority=JobPriority.BATCH)
+    for i in range(2):
+        await queue.submit(f"interactive{i}", client_id="a")
+
+    prompts = [(await queue.dequeue()).prompt for _ in range(4)]
+    assert prompts == ["interactive0", "interactive1", "batch0", "batch1"]
@@ -0,0 +1,88 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Tuple
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+
+from genmeme.db import JobRecord
+from genmeme.queue import JobStatus
+from genmeme.shared_queue import SharedQueue
+
+from conftest import make_session_factory
+
+
+@pytest_asyncio.fixture
+async def queues(db_path: Path) -> AsyncIterator[Tuple[SharedQueue, SharedQueue]]:
+    first = SharedQueue(session_factory=make_session_factory(db_path))
+    second = SharedQueue(session_factory=make_session_factory(db_path))
+    yield first, second
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_each_job_is_claimed_once(
+    queues: Tuple[SharedQueue, SharedQueue],
+) -> None:
+    first, second = queues
+    submitted_ids = {
+        (await first.submit(f"prompt {i}", client_id=f"client {i % 3}"))[0].job_id
+        for i in range(40)
+    }
+
+    jobs = await asyncio.gather(
+        *(queue.dequeue() for _ in range(20) for queue in (first, second))
+    )
+    claimed_ids = Counter(job.job_id for job in jobs)
+    assert set(claimed_ids) == submitted_ids
+    assert max(claimed_ids.values()) == 1
+    assert first.processing_job_ids.isdisjoint(second.processing_job_ids)
+    assert await second.get_queue_size() == 0
+    assert await second.get_in_flight_count() == 40
+
+
+@pytest.mark.asyncio
+async def test_cancelled_job_is_not_claimed(
+    queues: Tuple[SharedQueue, SharedQueue],
+) -> None:
+    first, second = queues
+    cancelled_job, _ = await first.submit("cancelled")
+    queued_job, position = await first.submit("queued")
+    assert position == 2
+
+    assert await second.cancel(cancelled_job.job_id) == JobStatus.QUEUED
+    assert await second.cancel(cancelled_job.job_id) is None
+    assert (await first.dequeue()).job_id == queued_job.job_id
+
+
+@pytest.mark.asyncio
+async def test_closing_queues_unfinished_jobs_again(db_path: Path) -> None:
+    closed = SharedQueue(session_factory=make_session_factory(db_path))
+    job, _ = await closed.submit("prompt")
+    assert (await closed.dequeue()).job_id == job.job_id
+    await closed.close()
+
+    queue = SharedQueue(session_factory=make_session_factory(db_path))
+    try:
+        assert (await queue.dequeue()).job_id == job.job_id
+    finally:
+        await queue.close()
+
+    with make_session_factory(db_path)() as session:
+        record = session.scalars(
+            select(JobRecord).where(JobRecord.job_id == job.job_id)
+        ).one()
+    # Closing the second queue handed the job back too
+    assert record.status == JobStatus.QUEUED.value
+    assert record.lease_owner is None
+
+
+def test_schema_is_created_by_concurrent_processes(db_path: Path) -> None:
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        factories = list(executor.map(make_session_factory, [db_path] * 8))
+    with factories[0]() as session:
+        assert session.scalars(select(JobRecord)).all() == []
@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from genmeme.server import APP
+from genmeme.templates import TemplateIndex, get_template_registry
+
+TEMPLATES = [
+    {
+        "id": "drake",
+        "name": "Drake Hotline Bling",
+        "description": "Preferring one thing",
+    },
+    {"id": "distracted_boyfriend", "name": "Distracted Boyfriend"},
+    {"id": "video", "name": "Video", "type": "video"},
+]
+
+
+@pytest.fixture
+def templates_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path / "templates.json"
+    path.write_text(json.dumps(TEMPLATES))
+    monkeypatch.setenv("TEMPLATES_PATH", str(path))
+    return path
+
+
+@pytest_asyncio.fixture
+async def client(templates_path: Path) -> AsyncIterator[httpx.AsyncClient]:
+    transport = httpx.ASGITransport(app=APP)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.asyncio
+async def test_template_list_is_revalidated_by_etag(
+    client: httpx.AsyncClient,
+) -> None:
+    response = await client.get("/api/v1/templates")
+    assert [t["id"] for t in response.json()] == ["drake", "distracted_boyfriend"]
+    etag = response.headers["ETag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = await client.get(
+            "/api/v1/templates", headers={"If-None-Match": if_none_match}
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+    response = await client.get(
+        "/api/v1/templates", headers={"If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+
+
+def test_search_matches_prefixes_and_ranks_by_field() -> None:
+    index = TemplateIndex(
+        [
+            {"id": "bender", "name": "Theme Park", "description": "Drake builds"},
+            {"id": "drake", "name": "Drake Hotline Bling"},
+            {"id": "drakes", "name": "Ducks"},
+        ]
+    )
+    # Exact id and name matches rank above a prefix and a description match
+    assert index.search("drake") == [1, 2, 0]
+    assert index.search("dra") == [1, 2, 0]
+    assert index.search("drake hotline") == [1]
+    assert index.search("zzz") == []
+    assert index.search("") == []
+
+
+def test_search_pages_image_templates(templates_path: Path) -> None:
+    registry = get_template_registry(str(templates_path))
+    assert registry.search("boyfriend") == (1, [TEMPLATES[1]])
+    total, templates = registry.search(limit=1, offset=1)
+    assert (total, templates) == (2, [TEMPLATES[1]])